@@ -1,36 +1,83 @@
+from typing import Optional
+
 from strhub.models.utils import create_model
 
 dependencies = ['torch', 'pytorch_lightning', 'timm']
 
 
-def parseq_tiny(pretrained: bool = False, decode_ar: bool = True, refine_iters: int = 1, **kwargs):
+def parseq_tiny(
+    pretrained: bool = False,
+    decode_ar: bool = True,
+    refine_iters: int = 1,
+    cascade_threshold: Optional[float] = None,
+    **kwargs,
+):
     """
     PARSeq tiny model (img_size=128x32, patch_size=8x4, d_model=192)
     @param pretrained: (bool) Use pretrained weights
     @param decode_ar: (bool) use AR decoding
     @param refine_iters: (int) number of refinement iterations to use
+    @param cascade_threshold: (float) if set, decode with NAR first, then re-decode with AR the samples whose
+        sequence confidence is below this threshold
     """
-    return create_model('parseq-tiny', pretrained, decode_ar=decode_ar, refine_iters=refine_iters, **kwargs)
+    return create_model(
+        'parseq-tiny',
+        pretrained,
+        decode_ar=decode_ar,
+        refine_iters=refine_iters,
+        cascade_threshold=cascade_threshold,
+        **kwargs,
+    )
 
 
-def parseq(pretrained: bool = False, decode_ar: bool = True, refine_iters: int = 1, **kwargs):
+def parseq(
+    pretrained: bool = False,
+    decode_ar: bool = True,
+    refine_iters: int = 1,
+    cascade_threshold: Optional[float] = None,
+    **kwargs,
+):
     """
     PARSeq base model (img_size=128x32, patch_size=8x4, d_model=384)
     @param pretrained: (bool) Use pretrained weights
     @param decode_ar: (bool) use AR decoding
     @param refine_iters: (int) number of refinement iterations to use
+    @param cascade_threshold: (float) if set, decode with NAR first, then re-decode with AR the samples whose
+        sequence confidence is below this threshold
     """
-    return create_model('parseq', pretrained, decode_ar=decode_ar, refine_iters=refine_iters, **kwargs)
+    return create_model(
+        'parseq',
+        pretrained,
+        decode_ar=decode_ar,
+        refine_iters=refine_iters,
+        cascade_threshold=cascade_threshold,
+        **kwargs,
+    )
 
 
-def parseq_patch16_224(pretrained: bool = False, decode_ar: bool = True, refine_iters: int = 1, **kwargs):
+def parseq_patch16_224(
+    pretrained: bool = False,
+    decode_ar: bool = True,
+    refine_iters: int = 1,
+    cascade_threshold: Optional[float] = None,
+    **kwargs,
+):
     """
     PARSeq base model (img_size=224x224, patch_size=16x16, d_model=384)
     @param pretrained: (bool) Use pretrained weights
     @param decode_ar: (bool) use AR decoding
     @param refine_iters: (int) number of refinement iterations to use
+    @param cascade_threshold: (float) if set, decode with NAR first, then re-decode with AR the samples whose
+        sequence confidence is below this threshold
     """
-    return create_model('parseq-patch16-224', pretrained, decode_ar=decode_ar, refine_iters=refine_iters, **kwargs)
+    return create_model(
+        'parseq-patch16-224',
+        pretrained,
+        decode_ar=decode_ar,
+        refine_iters=refine_iters,
+        cascade_threshold=cascade_threshold,
+        **kwargs,
+    )
 
 
 def abinet(pretrained: bool = False, iter_size: int = 3, **kwargs):
@@ -21,6 +21,7 @@ from PIL import Image
 import torch
 
 from strhub.data.module import SceneTextDataModule
+from strhub.models.export import use_onnx_runtime
 from strhub.models.utils import load_from_checkpoint, parse_model_args
 
 
@@ -29,18 +30,32 @@ def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('checkpoint', help="Model checkpoint (or 'pretrained=<model_id>')")
     parser.add_argument('--images', nargs='+', help='Images to read')
+    parser.add_argument(
+        '--onnx', help='Exported model (see tools/export_onnx.py) to run with ONNX Runtime instead, on the CPU.'
+    )
+    parser.add_argument('--quantize', choices=['dynamic', 'static'], help='Run the int8 quantized model on the CPU.')
+    parser.add_argument(
+        '--quantized_weights', help='Weights of the statically quantized model (see tools/quantize_static.py).'
+    )
     parser.add_argument('--device', default='cuda')
     args, unknown = parser.parse_known_args()
     kwargs = parse_model_args(unknown)
     print(f'Additional keyword arguments: {kwargs}')
 
-    model = load_from_checkpoint(args.checkpoint, **kwargs).eval().to(args.device)
-    img_transform = SceneTextDataModule.get_transform(model.hparams.img_size)
+    device = 'cpu' if args.onnx or args.quantize else args.device
+    model = load_from_checkpoint(
+        args.checkpoint, quantize=args.quantize, quantized_weights=args.quantized_weights, **kwargs
+    )
+    model = model.eval().to(device)
+    if args.onnx:
+        model = use_onnx_runtime(model, args.onnx)
+    img_transform = SceneTextDataModule.get_transform(model.hparams.img_size, normalize=False)
 
     for fname in args.images:
         # Load image and prepare for input
         image = Image.open(fname).convert('RGB')
-        image = img_transform(image).unsqueeze(0).to(args.device)
+        image = img_transform(image).unsqueeze(0).to(device)
+        image = SceneTextDataModule.normalize(image)
 
         p = model(image).softmax(-1)
         pred, p = model.tokenizer.decode(p)
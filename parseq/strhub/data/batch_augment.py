@@ -0,0 +1,288 @@
+# Scene Text Recognition Model Hub
+# Copyright 2022 Darwin Bautista
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Batched, tensor-based equivalent of `augment.rand_augment_transform()`.
+
+The ops work on a whole batch of same-sized images at once (typically on the GPU), right after collation.
+Pixel values are kept within [0, 255] and are rounded after every op to mimic the uint8 PIL ops.
+
+Differences from the PIL-based pipeline:
+1. The images are augmented after they have been resized. The geometric ops are applied in the resized pixel space,
+   and the expanded canvas of `Rotate` is resized back to the input size.
+2. Bilinear interpolation is always used for the geometric ops.
+3. Parameters which depend on the image size (GaussianBlur radius, PoissonNoise lambda) are based on the resized image.
+"""
+import math
+from typing import Optional, Union
+
+import torch
+import torch.nn.functional as F
+from torch import Tensor, nn
+
+from timm.data.auto_augment import _LEVEL_DENOM
+
+# Same as the ones used in rand_augment_transform()
+_HPARAMS = {
+    'rotate_deg': 30,
+    'shear_x_pct': 0.9,
+    'shear_y_pct': 0.2,
+    'translate_x_pct': 0.10,
+    'translate_y_pct': 0.30,
+}
+# timm's default fill color
+_FILL = 128.0
+
+
+def _rand_sign(n: int, device: torch.device) -> Tensor:
+    return torch.randint(0, 2, (n,), device=device) * 2.0 - 1.0
+
+
+def _grayscale(x: Tensor) -> Tensor:
+    # ITU-R 601-2 luma transform, same as PIL's convert('L')
+    r, g, b = x.unbind(1)
+    return (0.299 * r + 0.587 * g + 0.114 * b).round().unsqueeze(1)
+
+
+def _blend(degenerate: Tensor, x: Tensor, factor: Tensor) -> Tensor:
+    # Same as PIL.ImageEnhance
+    return degenerate + factor.view(-1, 1, 1, 1) * (x - degenerate)
+
+
+def auto_contrast(x: Tensor, _) -> Tensor:
+    lo = x.amin(dim=(2, 3), keepdim=True)
+    hi = x.amax(dim=(2, 3), keepdim=True)
+    scale = 255.0 / (hi - lo).clamp(min=1)
+    return torch.where(hi > lo, (x - lo) * scale, x)
+
+
+def equalize(x: Tensor, _) -> Tensor:
+    # Follows the implementation of PIL.ImageOps.equalize()
+    n, c, h, w = x.shape
+    flat = x.reshape(n * c, h * w).long()
+    hist = torch.zeros(n * c, 256, dtype=torch.long, device=x.device).scatter_add_(1, flat, torch.ones_like(flat))
+    # cumsum() of the non-zero indicators peaks first at the last non-zero bin.
+    last = (hist > 0).long().cumsum(1).argmax(1, keepdim=True)
+    step = (h * w - hist.gather(1, last)) // 255
+    lut = (step // 2 + hist.cumsum(1) - hist) // step.clamp(min=1)
+    out = lut.clamp(max=255).gather(1, flat)
+    # Nothing to equalize if step == 0
+    out = torch.where(step > 0, out, flat)
+    return out.view(n, c, h, w).to(x.dtype)
+
+
+def invert(x: Tensor, _) -> Tensor:
+    return 255.0 - x
+
+
+def posterize(x: Tensor, bits: Tensor) -> Tensor:
+    q = (2.0 ** (8 - bits)).view(-1, 1, 1, 1)
+    return (x / q).floor() * q
+
+
+def solarize(x: Tensor, thresh: Tensor) -> Tensor:
+    return torch.where(x >= thresh.view(-1, 1, 1, 1), 255.0 - x, x)
+
+
+def solarize_add(x: Tensor, add: Tensor, thresh: float = 128.0) -> Tensor:
+    return torch.where(x < thresh, x + add.view(-1, 1, 1, 1), x)
+
+
+def color(x: Tensor, factor: Tensor) -> Tensor:
+    return _blend(_grayscale(x), x, factor)
+
+
+def contrast(x: Tensor, factor: Tensor) -> Tensor:
+    mean = _grayscale(x).mean(dim=(1, 2, 3), keepdim=True).round()
+    return _blend(mean, x, factor)
+
+
+def brightness(x: Tensor, factor: Tensor) -> Tensor:
+    return x * factor.view(-1, 1, 1, 1)
+
+
+def gaussian_blur(x: Tensor, sigma: float) -> Tensor:
+    # sigma is constant for the whole batch (depends on the image size only). It's a Python float, so that the kernel
+    # size is known without a device-host sync.
+    radius = math.ceil(3 * sigma)
+    k = torch.arange(-radius, radius + 1, dtype=x.dtype, device=x.device)
+    k = torch.exp(-(k**2) / (2 * sigma**2))
+    k /= k.sum()
+    c = x.shape[1]
+    # Separable convolution. Replicate the border pixels like PIL.
+    x = F.pad(x, (radius, radius, radius, radius), mode='replicate')
+    x = F.conv2d(x, k.view(1, 1, 1, -1).expand(c, -1, -1, -1), groups=c)
+    return F.conv2d(x, k.view(1, 1, -1, 1).expand(c, -1, -1, -1), groups=c)
+
+
+def poisson_noise(x: Tensor, lam: Tensor) -> Tensor:
+    # Same as imgaug.augmenters.AdditivePoissonNoise(lam, per_channel=False)
+    n, _, h, w = x.shape
+    noise = torch.poisson(lam.view(-1, 1, 1, 1).expand(n, 1, h, w).contiguous())
+    return x + noise * _rand_sign(n * h * w, x.device).view(n, 1, h, w)
+
+
+def rotate_expand(degrees: Tensor, h: int, w: int) -> Tensor:
+    """Rotate with expand=True, then resize the expanded canvas back to the original size."""
+    a = torch.deg2rad(-degrees)
+    cos, sin = a.cos(), a.sin()
+    cw = w * cos.abs() + h * sin.abs()
+    ch = w * sin.abs() + h * cos.abs()
+    sx, sy = cw / w, ch / h
+    zeros, ones = torch.zeros_like(a), torch.ones_like(a)
+    return torch.stack([
+        torch.stack([cos * sx, sin * sy, w / 2 - (cos * cw + sin * ch) / 2], -1),
+        torch.stack([-sin * sx, cos * sy, h / 2 + (sin * cw - cos * ch) / 2], -1),
+        torch.stack([zeros, zeros, ones], -1),
+    ], 1)
+
+
+def _affine(a: Tensor, b: Tensor, c: Tensor, d: Tensor, e: Tensor, f: Tensor) -> Tensor:
+    zeros, ones = torch.zeros_like(a), torch.ones_like(a)
+    return torch.stack([
+        torch.stack([a, b, c], -1),
+        torch.stack([d, e, f], -1),
+        torch.stack([zeros, zeros, ones], -1),
+    ], 1)
+
+
+def shear_x(factor: Tensor, h: int, w: int) -> Tensor:
+    zeros, ones = torch.zeros_like(factor), torch.ones_like(factor)
+    return _affine(ones, factor, zeros, zeros, ones, zeros)
+
+
+def shear_y(factor: Tensor, h: int, w: int) -> Tensor:
+    zeros, ones = torch.zeros_like(factor), torch.ones_like(factor)
+    return _affine(ones, zeros, zeros, factor, ones, zeros)
+
+
+def translate_x_rel(pct: Tensor, h: int, w: int) -> Tensor:
+    zeros, ones = torch.zeros_like(pct), torch.ones_like(pct)
+    return _affine(ones, zeros, pct * w, zeros, ones, zeros)
+
+
+def translate_y_rel(pct: Tensor, h: int, w: int) -> Tensor:
+    zeros, ones = torch.zeros_like(pct), torch.ones_like(pct)
+    return _affine(ones, zeros, zeros, zeros, ones, pct * h)
+
+
+def warp_affine(x: Tensor, matrices: Tensor) -> Tensor:
+    """Apply the affine transforms which map output pixel coordinates to input pixel coordinates (like PIL)."""
+    n, _, h, w = x.shape
+    # Pixel coordinates to normalized coordinates (align_corners=False)
+    to_norm = x.new_tensor([[2 / w, 0, -1], [0, 2 / h, -1], [0, 0, 1]])
+    theta = (to_norm @ matrices @ torch.linalg.inv(to_norm))[:, :2]
+    grid = F.affine_grid(theta, [n, 1, h, w], align_corners=False)
+    # Zero-padding of the zero-centered image results in _FILL for out-of-bounds pixels.
+    return F.grid_sample(x - _FILL, grid, mode='bilinear', padding_mode='zeros', align_corners=False) + _FILL
+
+
+# The ops of rand_augment_transform(), i.e. timm's _RAND_INCREASING_TRANSFORMS except SharpnessIncreasing,
+# plus GaussianBlur and PoissonNoise.
+_COLOR_OPS = {
+    'AutoContrast': auto_contrast,
+    'Equalize': equalize,
+    'Invert': invert,
+    'PosterizeIncreasing': posterize,
+    'SolarizeIncreasing': solarize,
+    'SolarizeAdd': solarize_add,
+    'ColorIncreasing': color,
+    'ContrastIncreasing': contrast,
+    'BrightnessIncreasing': brightness,
+    'GaussianBlur': gaussian_blur,
+    'PoissonNoise': poisson_noise,
+}
+_GEOMETRIC_OPS = {
+    'Rotate': rotate_expand,
+    'ShearX': shear_x,
+    'ShearY': shear_y,
+    'TranslateXRel': translate_x_rel,
+    'TranslateYRel': translate_y_rel,
+}
+
+
+class BatchRandAugment(nn.Module):
+    """RandAugment for batches of uint8 image tensors (N, C, H, W).
+
+    Like rand_augment_transform(), `num_layers` distinct ops are chosen for each image, and each op is applied with
+    probability `prob`. The magnitudes follow timm's level-to-arg functions (and aa_overrides) at `magnitude`.
+    """
+
+    def __init__(self, magnitude: int = 5, num_layers: int = 3, prob: float = 0.5, hparams: Optional[dict] = None):
+        super().__init__()
+        self.magnitude = magnitude
+        self.num_layers = num_layers
+        self.prob = prob
+        self.hparams = _HPARAMS if hparams is None else hparams
+        self.op_names = list(_COLOR_OPS) + list(_GEOMETRIC_OPS)
+
+    def _level(self, max_value: float) -> float:
+        return self.magnitude / _LEVEL_DENOM * max_value
+
+    def _get_args(self, name: str, n: int, h: int, w: int, device: torch.device) -> Union[Tensor, float]:
+        """Per-image op arguments (or a single one for the whole batch, for GaussianBlur)"""
+        sign = _rand_sign(n, device)
+        if name in ('AutoContrast', 'Equalize', 'Invert'):
+            arg = 0.0
+        elif name == 'PosterizeIncreasing':
+            arg = 4 - int(self._level(4))
+        elif name == 'SolarizeIncreasing':
+            arg = 256 - int(self._level(256))
+        elif name == 'SolarizeAdd':
+            arg = int(self._level(110))
+        elif name in ('ColorIncreasing', 'ContrastIncreasing', 'BrightnessIncreasing'):
+            return (1.0 + sign * self._level(0.9)).clamp(min=0.1)
+        elif name == 'GaussianBlur':
+            return float(round(min(self._level(4), max(1, 0.02 * max(h, w)))))
+        elif name == 'PoissonNoise':
+            arg = round(min(self._level(40), max(1, 0.2 * max(h, w)))) | 1
+        else:
+            key = {
+                'Rotate': 'rotate_deg',
+                'ShearX': 'shear_x_pct',
+                'ShearY': 'shear_y_pct',
+                'TranslateXRel': 'translate_x_pct',
+                'TranslateYRel': 'translate_y_pct',
+            }[name]
+            return sign * self._level(self.hparams[key])
+        return torch.full((n,), float(arg), device=device)
+
+    @torch.no_grad()
+    def forward(self, images: Tensor) -> Tensor:
+        dtype = images.dtype
+        x = images.float()
+        n, _, h, w = x.shape
+        # Choose num_layers ops per image without replacement (same as uniform choice_weights in RandAugment).
+        op_idx = torch.rand(n, len(self.op_names), device=x.device).argsort(1)[:, : self.num_layers]
+        apply = torch.rand(n, self.num_layers, device=x.device) < self.prob
+        op_idx = torch.where(apply, op_idx, -1).t().cpu()
+        for layer_ops in op_idx:
+            matrices = []
+            warp_idx = []
+            for k, name in enumerate(self.op_names):
+                idx = (layer_ops == k).nonzero().squeeze(1)
+                if not len(idx):
+                    continue
+                idx = idx.to(x.device)
+                args = self._get_args(name, len(idx), h, w, x.device)
+                if name in _COLOR_OPS:
+                    x[idx] = _COLOR_OPS[name](x[idx], args).round_().clamp_(0, 255)
+                else:
+                    matrices.append(_GEOMETRIC_OPS[name](args, h, w))
+                    warp_idx.append(idx)
+            # All geometric ops of this layer are applied at once.
+            if warp_idx:
+                idx = torch.cat(warp_idx)
+                x[idx] = warp_affine(x[idx], torch.cat(matrices)).round_().clamp_(0, 255)
+        return x.to(dtype)
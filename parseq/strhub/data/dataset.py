@@ -12,14 +12,22 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import array
 import glob
+import hashlib
 import io
+import json
 import logging
+import multiprocessing
+import os
+import time
 import unicodedata
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path, PurePath
 from typing import Callable, Optional, Union
 
 import lmdb
+import numpy as np
 from PIL import Image
 
 from torch.utils.data import ConcatDataset, Dataset
@@ -28,22 +36,145 @@ from strhub.data.utils import CharsetAdapter
 
 log = logging.getLogger(__name__)
 
+# Bump this whenever the label preprocessing or the index layout changes.
+_INDEX_VERSION = 1
+# Most image headers (even JPEGs with the usual metadata) fit within this many bytes.
+_IMAGE_HEADER_SIZE = 4096
 
-def build_tree_dataset(root: Union[PurePath, str], *args, **kwargs):
+
+def get_image_size(buf) -> tuple[int, int]:
+    """Get the (width, height) of an encoded image by parsing its header only.
+
+    `buf` can be a memoryview of an LMDB value (i.e. from a `buffers=True` transaction), in which case only the pages
+    spanned by the header are actually read from disk.
+    """
+    try:
+        return Image.open(io.BytesIO(buf[:_IMAGE_HEADER_SIZE])).size
+    except OSError:
+        # The header doesn't fit (e.g. large EXIF data). Fallback to the full image.
+        return Image.open(io.BytesIO(buf)).size
+
+
+def read_image_dims(txn, index: int) -> tuple[int, int]:
+    """Read the (width, height) of an LMDB sample from its `dim-%09d` record if available, or the image header."""
+    dims = txn.get(f'dim-{index:09d}'.encode())
+    if dims is not None:
+        w, h = bytes(dims).split()
+        return int(w), int(h)
+    return get_image_size(txn.get(f'image-{index:09d}'.encode()))
+
+
+def decode_image(buf, min_size: Optional[tuple[int, int]] = None) -> Image.Image:
+    """Decode an image to RGB.
+
+    If `min_size` (height, width) is given, JPEGs are decoded at the smallest DCT scale (1/2, 1/4, or 1/8) for which
+    the image is still at least `min_size`. This is much faster for images which are much larger than needed.
+    """
+    img = Image.open(io.BytesIO(buf))
+    if min_size is not None:
+        img.draft('RGB', (min_size[1], min_size[0]))
+    return img.convert('RGB')
+
+
+def preprocess_label(
+    label: str, charset_adapter: CharsetAdapter, remove_whitespace: bool, normalize_unicode: bool, max_label_len: int
+) -> str:
+    """Transform a raw label according to the preprocessing options. Returns an empty string if it is filtered out."""
+    # Normally, whitespace is removed from the labels.
+    if remove_whitespace:
+        label = ''.join(label.split())
+    # Normalize unicode composites (if any) and convert to compatible ASCII characters
+    if normalize_unicode:
+        label = unicodedata.normalize('NFKD', label).encode('ascii', 'ignore').decode()
+    # Filter by length before removing unsupported characters. The original label might be too long.
+    if len(label) > max_label_len:
+        return ''
+    # We filter out samples which don't contain any supported characters
+    return charset_adapter(label)
+
+
+def _write_index(path: Path, arrays: list[np.ndarray]) -> None:
+    """Write the arrays back-to-back in .npy format. The file is written atomically."""
+    tmp = path.with_name(f'.{path.name}.{os.getpid()}.tmp')
+    try:
+        with open(tmp, 'wb') as f:
+            for a in arrays:
+                np.lib.format.write_array(f, np.ascontiguousarray(a), allow_pickle=False)
+        os.replace(tmp, path)
+    finally:
+        tmp.unlink(missing_ok=True)
+
+
+def _read_index(path: Path, header: bytes) -> Optional[list[np.ndarray]]:
+    """Memory-map the arrays stored in an index file. Returns None if the file is missing or stale."""
+    try:
+        size = path.stat().st_size
+        buf = np.memmap(path, dtype=np.uint8, mode='r')
+        arrays = []
+        with open(path, 'rb') as f:
+            while f.tell() < size:
+                version = np.lib.format.read_magic(f)
+                if version == (1, 0):
+                    shape, _, dtype = np.lib.format.read_array_header_1_0(f)
+                else:
+                    shape, _, dtype = np.lib.format.read_array_header_2_0(f)
+                start = f.tell()
+                end = start + int(np.prod(shape)) * dtype.itemsize
+                arrays.append(buf[start:end].view(dtype).reshape(shape))
+                f.seek(end)
+    except (OSError, ValueError):
+        return None
+    # The first array is the header. Anything else means the data or the preprocessing parameters have changed.
+    if not arrays or arrays[0].tobytes() != header:
+        return None
+    return arrays[1:]
+
+
+def _build_lmdb_dataset(root: str, *args, **kwargs):
+    start = time.perf_counter()
+    dataset = LmdbDataset(root, *args, **kwargs)
+    return dataset, time.perf_counter() - start
+
+
+def build_tree_dataset(root: Union[PurePath, str], *args, num_workers: Optional[int] = None, **kwargs):
+    """Build a ConcatDataset out of all the LMDBs found under `root`.
+
+    The LMDBs are preprocessed in parallel using up to `num_workers` processes (default: number of CPUs).
+    The datasets are always concatenated in sorted path order.
+    """
     try:
         kwargs.pop('root')  # prevent 'root' from being passed via kwargs
     except KeyError:
         pass
+    # The transform is applied in the main process only. No need to send it to (and back from) the workers.
+    transform = kwargs.pop('transform', None)
     root = Path(root).absolute()
     log.info(f'dataset root:\t{root}')
-    datasets = []
-    for mdb in glob.glob(str(root / '**/data.mdb'), recursive=True):
-        mdb = Path(mdb)
-        ds_name = str(mdb.parent.relative_to(root))
-        ds_root = str(mdb.parent.absolute())
-        dataset = LmdbDataset(ds_root, *args, **kwargs)
-        log.info(f'\tlmdb:\t{ds_name}\tnum samples: {len(dataset)}')
-        datasets.append(dataset)
+    mdbs = sorted(Path(mdb).parent for mdb in glob.glob(str(root / '**/data.mdb'), recursive=True))
+    num_workers = min(len(mdbs), num_workers or os.cpu_count() or 1)
+    datasets = {}
+
+    def _log_progress(mdb, dataset, elapsed):
+        ds_name = str(mdb.relative_to(root))
+        log.info(
+            f'\t[{len(datasets)}/{len(mdbs)}]\tlmdb:\t{ds_name}\tnum samples: {len(dataset)}\ttime: {elapsed:.2f}s'
+        )
+
+    if num_workers > 1:
+        # Not fork: the calling process (e.g. under DDP) may already hold CUDA and NCCL state, which isn't fork-safe.
+        with ProcessPoolExecutor(num_workers, mp_context=multiprocessing.get_context('forkserver')) as executor:
+            futures = {executor.submit(_build_lmdb_dataset, str(mdb), *args, **kwargs): mdb for mdb in mdbs}
+            for future in as_completed(futures):
+                mdb = futures[future]
+                datasets[mdb], elapsed = future.result()
+                _log_progress(mdb, datasets[mdb], elapsed)
+    else:
+        for mdb in mdbs:
+            datasets[mdb], elapsed = _build_lmdb_dataset(str(mdb), *args, **kwargs)
+            _log_progress(mdb, datasets[mdb], elapsed)
+    datasets = [datasets[mdb] for mdb in mdbs]
+    for dataset in datasets:
+        dataset.transform = transform
     return ConcatDataset(datasets)
 
 
@@ -52,7 +183,11 @@ class LmdbDataset(Dataset):
 
     It supports both labelled and unlabelled datasets. For unlabelled datasets, the image index itself is returned
     as the label. Unicode characters are normalized by default. Case-sensitivity is inferred from the charset.
-    Labels are transformed according to the charset.
+    Labels are transformed according to the charset. If `decode_size` (height, width) is set, JPEGs are decoded at a
+    reduced resolution which is still at least `decode_size` (see decode_image()).
+
+    The preprocessed labels are cached in an index file alongside the LMDB (labels-<hash>.idx), which is memory-mapped
+    on subsequent loads. The index is rebuilt automatically if the LMDB or the preprocessing parameters change.
     """
 
     def __init__(
@@ -65,17 +200,41 @@ class LmdbDataset(Dataset):
         normalize_unicode: bool = True,
         unlabelled: bool = False,
         transform: Optional[Callable] = None,
+        decode_size: Optional[tuple[int, int]] = None,
     ):
         self._env = None
         self.root = root
         self.unlabelled = unlabelled
         self.transform = transform
-        self.labels = []
-        self.filtered_index_list = []
+        self.decode_size = decode_size
+        # Labels are stored as one packed UTF-8 buffer plus offsets, i.e. the label of sample i is
+        # label_data[label_offsets[i]:label_offsets[i + 1]]. Unlike lists of str/int, these arrays don't have
+        # per-item refcounts, so their pages stay shared (not copied on write) across forked DataLoader workers.
+        self.filtered_index_list = np.empty(0, dtype=np.int32)
+        self.label_offsets = np.zeros(1, dtype=np.int64)
+        self.label_data = np.empty(0, dtype=np.uint8)
+        self._index_file = None
         self.num_samples = self._preprocess_labels(
             charset, remove_whitespace, normalize_unicode, max_label_len, min_image_dim
         )
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_env'] = None
+        # A memory-mapped index is reopened rather than copied when pickled (e.g. sent to/from another process).
+        if self._index_file is not None:
+            del state['filtered_index_list'], state['label_offsets'], state['label_data']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self._index_file is not None:
+            path, header = self._index_file
+            arrays = _read_index(path, header)
+            if arrays is None:
+                raise RuntimeError(f'Label index is missing or stale: {path}')
+            self.filtered_index_list, self.label_offsets, self.label_data = arrays
+
     def __del__(self):
         if self._env is not None:
             self._env.close()
@@ -92,55 +251,115 @@ class LmdbDataset(Dataset):
             self._env = self._create_env()
         return self._env
 
+    def _index_path_and_header(self, num_samples, **params) -> tuple[Path, bytes]:
+        """The index is named after the preprocessing parameters, while its header identifies the LMDB contents.
+
+        Hence, datasets preprocessed with different parameters (e.g. train vs test charset) get separate index files,
+        and an index file is automatically rebuilt whenever the underlying LMDB is modified.
+        """
+        params = json.dumps(params, sort_keys=True)
+        digest = hashlib.sha1(params.encode()).hexdigest()[:16]
+        st = os.stat(os.path.join(self.root, 'data.mdb'))
+        header = json.dumps({
+            'version': _INDEX_VERSION,
+            'size': st.st_size,
+            'mtime': st.st_mtime_ns,
+            'num_samples': num_samples,
+            'params': params,
+        })
+        return Path(self.root, f'labels-{digest}.idx'), header.encode()
+
     def _preprocess_labels(self, charset, remove_whitespace, normalize_unicode, max_label_len, min_image_dim):
-        charset_adapter = CharsetAdapter(charset)
-        with self._create_env() as env, env.begin() as txn:
-            num_samples = int(txn.get('num-samples'.encode()))
+        # Use buffers=True to avoid reading whole images whenever their headers have to be parsed.
+        with self._create_env() as env, env.begin(buffers=True) as txn:
+            num_samples = int(bytes(txn.get('num-samples'.encode())))
             if self.unlabelled:
                 return num_samples
-            for index in range(num_samples):
-                index += 1  # lmdb starts with 1
-                label_key = f'label-{index:09d}'.encode()
-                label = txn.get(label_key).decode()
-                # Normally, whitespace is removed from the labels.
-                if remove_whitespace:
-                    label = ''.join(label.split())
-                # Normalize unicode composites (if any) and convert to compatible ASCII characters
-                if normalize_unicode:
-                    label = unicodedata.normalize('NFKD', label).encode('ascii', 'ignore').decode()
-                # Filter by length before removing unsupported characters. The original label might be too long.
-                if len(label) > max_label_len:
-                    continue
-                label = charset_adapter(label)
-                # We filter out samples which don't contain any supported characters
-                if not label:
+            path, header = self._index_path_and_header(
+                num_samples,
+                charset=charset,
+                remove_whitespace=remove_whitespace,
+                normalize_unicode=normalize_unicode,
+                max_label_len=max_label_len,
+                min_image_dim=min_image_dim,
+            )
+            arrays = _read_index(path, header)
+            if arrays is None:
+                arrays = self._scan_labels(
+                    txn, num_samples, charset, remove_whitespace, normalize_unicode, max_label_len, min_image_dim
+                )
+                try:
+                    _write_index(path, [np.frombuffer(header, dtype=np.uint8)] + arrays)
+                except OSError as e:
+                    log.warning(f'Unable to save the label index to {path}: {e}')
+                else:
+                    # Use the memory-mapped copy so that the pages are shared by all DataLoader workers.
+                    mapped = _read_index(path, header)
+                    if mapped is not None:
+                        arrays = mapped
+                        self._index_file = (path, header)
+            else:
+                self._index_file = (path, header)
+        self.filtered_index_list, self.label_offsets, self.label_data = arrays
+        return len(self.filtered_index_list)
+
+    @staticmethod
+    def _scan_labels(
+        txn, num_samples, charset, remove_whitespace, normalize_unicode, max_label_len, min_image_dim
+    ) -> list[np.ndarray]:
+        charset_adapter = CharsetAdapter(charset)
+        # Build the index directly into compact buffers. Millions of small Python objects would bloat the peak memory.
+        filtered_index_list = array.array('i')
+        label_offsets = array.array('q', [0])
+        label_data = bytearray()
+        for index in range(num_samples):
+            index += 1  # lmdb starts with 1
+            label_key = f'label-{index:09d}'.encode()
+            label = bytes(txn.get(label_key)).decode()
+            label = preprocess_label(label, charset_adapter, remove_whitespace, normalize_unicode, max_label_len)
+            if not label:
+                continue
+            # Filter images that are too small.
+            if min_image_dim > 0:
+                w, h = read_image_dims(txn, index)
+                if w < min_image_dim or h < min_image_dim:
                     continue
-                # Filter images that are too small.
-                if min_image_dim > 0:
-                    img_key = f'image-{index:09d}'.encode()
-                    buf = io.BytesIO(txn.get(img_key))
-                    w, h = Image.open(buf).size
-                    if w < self.min_image_dim or h < self.min_image_dim:
-                        continue
-                self.labels.append(label)
-                self.filtered_index_list.append(index)
-        return len(self.labels)
+            label_data += label.encode()
+            label_offsets.append(len(label_data))
+            filtered_index_list.append(index)
+        return [
+            np.frombuffer(filtered_index_list, dtype=np.int32),
+            np.frombuffer(label_offsets, dtype=np.int64),
+            np.frombuffer(label_data, dtype=np.uint8),
+        ]
 
     def __len__(self):
         return self.num_samples
 
+    def label_lengths(self) -> np.ndarray:
+        """Returns the length (number of characters) of each label."""
+        lengths = np.diff(self.label_offsets)
+        # For non-ASCII labels, count only the first byte of each UTF-8 encoded character.
+        if len(self.label_data) and (self.label_data >= 0x80).any():
+            is_char = (self.label_data & 0xC0) != 0x80
+            lengths = np.add.reduceat(is_char, self.label_offsets[:-1], dtype=np.int64)
+        return lengths
+
+    def get_label(self, index: int) -> str:
+        start, end = self.label_offsets[index : index + 2]
+        return self.label_data[start:end].tobytes().decode()
+
     def __getitem__(self, index):
         if self.unlabelled:
             label = index
         else:
-            label = self.labels[index]
-            index = self.filtered_index_list[index]
+            label = self.get_label(index)
+            index = int(self.filtered_index_list[index])
 
         img_key = f'image-{index:09d}'.encode()
         with self.env.begin() as txn:
             imgbuf = txn.get(img_key)
-        buf = io.BytesIO(imgbuf)
-        img = Image.open(buf).convert('RGB')
+        img = decode_image(imgbuf, self.decode_size)
 
         if self.transform is not None:
             img = self.transform(img)
@@ -0,0 +1,77 @@
+# Scene Text Recognition Model Hub
+# Copyright 2022 Darwin Bautista
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from typing import Sequence
+
+import cv2
+import numpy as np
+
+import torch
+from torch import Tensor
+from torch.utils.data import get_worker_info
+
+
+def resize_into(img: np.ndarray, out: np.ndarray) -> None:
+    """Resize `img` (H, W, C) into `out`, approximating the antialiased bicubic resize of PIL.
+
+    INTER_CUBIC doesn't antialias, so INTER_AREA is used along the axes which are downscaled.
+    """
+    h, w = out.shape[:2]
+    ih, iw = img.shape[:2]
+    if ih == h and iw == w:
+        out[...] = img
+    elif ih >= h and iw >= w:
+        cv2.resize(img, (w, h), dst=out, interpolation=cv2.INTER_AREA)
+    elif ih <= h and iw <= w:
+        cv2.resize(img, (w, h), dst=out, interpolation=cv2.INTER_CUBIC)
+    else:
+        # Downscale one axis first, then upscale the other one.
+        size = (iw, h) if ih > h else (w, ih)
+        img = cv2.resize(img, size, interpolation=cv2.INTER_AREA)
+        cv2.resize(img, (w, h), dst=out, interpolation=cv2.INTER_CUBIC)
+
+
+class FusedResizeCollate:
+    """Collate function which resizes the (PIL) images straight into the batch tensor.
+
+    It replaces Resize + ToTensor + Normalize + default_collate. The batch is allocated once, in shared memory when
+    running in a DataLoader worker (like default_collate) or in pinned memory otherwise, and each image is resized
+    directly into its slot. The images are output as uint8 (N, C, H, W) in channels-last memory format, and are
+    meant to be normalized on the device.
+    """
+
+    def __init__(self, img_size: Sequence[int], pin_memory: bool = True) -> None:
+        self.img_size = tuple(img_size)
+        self.pin_memory = pin_memory
+        self._in_worker = False
+
+    def _alloc(self, n: int) -> Tensor:
+        shape = (n, *self.img_size, 3)
+        if get_worker_info() is not None:
+            if not self._in_worker:
+                # The DataLoader workers already provide the parallelism.
+                cv2.setNumThreads(1)
+                self._in_worker = True
+            elem = torch.empty(0, dtype=torch.uint8)
+            storage = elem._typed_storage()._new_shared(int(np.prod(shape)), device=elem.device)
+            return elem.new(storage).resize_(shape)
+        return torch.empty(shape, dtype=torch.uint8, pin_memory=self.pin_memory and torch.cuda.is_available())
+
+    def __call__(self, batch: Sequence[tuple]) -> tuple[Tensor, list]:
+        images, labels = zip(*batch)
+        out = self._alloc(len(images))
+        for img, slot in zip(images, out.numpy()):
+            resize_into(np.asarray(img), slot)
+        return out.permute(0, 3, 1, 2), list(labels)
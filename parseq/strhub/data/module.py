@@ -13,15 +13,19 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
 from pathlib import PurePath
 from typing import Callable, Optional, Sequence
 
-from torch.utils.data import DataLoader
+import torch
+from torch import Tensor
+from torch.utils.data import DataLoader, RandomSampler
 from torchvision import transforms as T
 
 import pytorch_lightning as pl
 
 from .dataset import LmdbDataset, build_tree_dataset
+from .sampler import BucketBatchSampler, get_label_lengths
 
 
 class SceneTextDataModule(pl.LightningDataModule):
@@ -46,6 +50,13 @@ class SceneTextDataModule(pl.LightningDataModule):
         min_image_dim: int = 0,
         rotation: int = 0,
         collate_fn: Optional[Callable] = None,
+        bucket_by_length: bool = False,
+        batch_augment: bool = False,
+        uint8_images: bool = False,
+        train_format: str = 'lmdb',
+        shuffle_buffer: int = 5000,
+        reduced_decode: bool = False,
+        fused_transform: bool = False,
     ):
         super().__init__()
         self.root_dir = root_dir
@@ -62,11 +73,39 @@ class SceneTextDataModule(pl.LightningDataModule):
         self.min_image_dim = min_image_dim
         self.rotation = rotation
         self.collate_fn = collate_fn
+        self.fused_transform = fused_transform
+        if fused_transform:
+            if collate_fn is not None:
+                raise ValueError('A custom collate_fn cannot be used with fused_transform')
+            from .fused import FusedResizeCollate
+
+            self.collate_fn = FusedResizeCollate(self.img_size)
+        self.bucket_by_length = bucket_by_length
+        self.batch_augment = batch_augment
+        self.uint8_images = uint8_images
+        if train_format not in ('lmdb', 'shards'):
+            raise ValueError(f"train_format should be either 'lmdb' or 'shards', got '{train_format}'")
+        if train_format == 'shards' and bucket_by_length:
+            raise ValueError('bucket_by_length is not supported for sharded datasets')
+        self.train_format = train_format
+        self.shuffle_buffer = shuffle_buffer
+        self.reduced_decode = reduced_decode
+        self._batch_augment = None
+        if augment and batch_augment:
+            from .batch_augment import BatchRandAugment
+
+            self._batch_augment = BatchRandAugment()
         self._train_dataset = None
         self._val_dataset = None
 
     @staticmethod
-    def get_transform(img_size: tuple[int], augment: bool = False, rotation: int = 0):
+    def get_transform(
+        img_size: tuple[int], augment: bool = False, rotation: int = 0, normalize: bool = True, fused: bool = False
+    ):
+        """Per-sample image transform. If `normalize` is False, the output is a uint8 tensor (C, H, W) instead.
+
+        If `fused` is True, the images are left as PIL images (not resized) for FusedResizeCollate.
+        """
         transforms = []
         if augment:
             from .augment import rand_augment_transform
@@ -74,33 +113,90 @@ class SceneTextDataModule(pl.LightningDataModule):
             transforms.append(rand_augment_transform())
         if rotation:
             transforms.append(lambda img: img.rotate(rotation, expand=True))
-        transforms.extend([
-            T.Resize(img_size, T.InterpolationMode.BICUBIC),
-            T.ToTensor(),
-            T.Normalize(0.5, 0.5),
-        ])
+        if fused:
+            return T.Compose(transforms)
+        transforms.append(T.Resize(img_size, T.InterpolationMode.BICUBIC))
+        if normalize:
+            transforms.extend([T.ToTensor(), T.Normalize(0.5, 0.5)])
+        else:
+            transforms.append(T.PILToTensor())
         return T.Compose(transforms)
 
+    @staticmethod
+    def normalize(images: Tensor) -> Tensor:
+        """Equivalent to ToTensor() + Normalize(0.5, 0.5) for a batch of uint8 images."""
+        return images.float().div_(127.5).sub_(1.0)
+
+    def _get_transform(self, augment: bool = False, rotation: int = 0):
+        return self.get_transform(
+            self.img_size, augment, rotation, normalize=not self.uint8_images, fused=self.fused_transform
+        )
+
+    def _build_workers(self) -> Optional[int]:
+        """Number of processes for preprocessing the LMDBs (see build_tree_dataset()).
+
+        Under DDP, every process on the node builds the datasets at the same time, so they share the CPUs.
+        """
+        if self.trainer is None or self.trainer.num_devices < 2:
+            return None  # all the CPUs
+        return max(1, (os.cpu_count() or 1) // self.trainer.num_devices)
+
+    def _decode_size(self, rotation: int = 0) -> Optional[tuple[int, int]]:
+        """Minimum size of the decoded images such that they're never upscaled by the transform."""
+        if not self.reduced_decode:
+            return None
+        h, w = self.img_size
+        if rotation % 180 == 90:
+            return w, h
+        if rotation % 90:
+            # Conservative for arbitrary angles
+            side = max(h, w)
+            return side, side
+        return h, w
+
     @property
     def train_dataset(self):
         if self._train_dataset is None:
-            transform = self.get_transform(self.img_size, self.augment)
+            if self._batch_augment is None:
+                transform = self._get_transform(self.augment)
+            else:
+                # Augmentation is deferred to on_after_batch_transfer()
+                transform = self.get_transform(self.img_size, normalize=False, fused=self.fused_transform)
             root = PurePath(self.root_dir, 'train', self.train_dir)
-            self._train_dataset = build_tree_dataset(
-                root,
-                self.charset_train,
-                self.max_label_length,
-                self.min_image_dim,
-                self.remove_whitespace,
-                self.normalize_unicode,
-                transform=transform,
-            )
+            if self.train_format == 'shards':
+                from .shards import ShardDataset
+
+                self._train_dataset = ShardDataset(
+                    root,
+                    self.charset_train,
+                    self.max_label_length,
+                    self.min_image_dim,
+                    self.remove_whitespace,
+                    self.normalize_unicode,
+                    self.shuffle_buffer,
+                    transform=transform,
+                    decode_size=self._decode_size(),
+                    batch_size=self.batch_size,
+                    num_workers=self.num_workers,
+                )
+            else:
+                self._train_dataset = build_tree_dataset(
+                    root,
+                    self.charset_train,
+                    self.max_label_length,
+                    self.min_image_dim,
+                    self.remove_whitespace,
+                    self.normalize_unicode,
+                    transform=transform,
+                    decode_size=self._decode_size(),
+                    num_workers=self._build_workers(),
+                )
         return self._train_dataset
 
     @property
     def val_dataset(self):
         if self._val_dataset is None:
-            transform = self.get_transform(self.img_size)
+            transform = self._get_transform()
             root = PurePath(self.root_dir, 'val')
             self._val_dataset = build_tree_dataset(
                 root,
@@ -110,14 +206,34 @@ class SceneTextDataModule(pl.LightningDataModule):
                 self.remove_whitespace,
                 self.normalize_unicode,
                 transform=transform,
+                decode_size=self._decode_size(),
+                num_workers=self._build_workers(),
             )
         return self._val_dataset
 
+    def on_after_batch_transfer(self, batch, dataloader_idx):
+        images, labels = batch
+        if self._batch_augment is not None and self.trainer.training:
+            images = self._batch_augment(images)
+        # uint8 images are only normalized once they're on the device.
+        if images.dtype == torch.uint8:
+            images = self.normalize(images)
+        return images, labels
+
     def train_dataloader(self):
+        if self.bucket_by_length:
+            # Length-homogeneous batches. Lightning replaces the RandomSampler with a DistributedSampler for DDP.
+            sampler = RandomSampler(self.train_dataset)
+            lengths = get_label_lengths(self.train_dataset)
+            batch_kwargs = dict(batch_sampler=BucketBatchSampler(sampler, self.batch_size, False, lengths))
+        elif self.train_format == 'shards':
+            # Shuffling is done by the dataset itself.
+            batch_kwargs = dict(batch_size=self.batch_size)
+        else:
+            batch_kwargs = dict(batch_size=self.batch_size, shuffle=True)
         return DataLoader(
             self.train_dataset,
-            batch_size=self.batch_size,
-            shuffle=True,
+            **batch_kwargs,
             num_workers=self.num_workers,
             persistent_workers=self.num_workers > 0,
             pin_memory=True,
@@ -135,7 +251,7 @@ class SceneTextDataModule(pl.LightningDataModule):
         )
 
     def test_dataloaders(self, subset):
-        transform = self.get_transform(self.img_size, rotation=self.rotation)
+        transform = self._get_transform(rotation=self.rotation)
         root = PurePath(self.root_dir, 'test')
         datasets = {
             s: LmdbDataset(
@@ -146,6 +262,7 @@ class SceneTextDataModule(pl.LightningDataModule):
                 self.remove_whitespace,
                 self.normalize_unicode,
                 transform=transform,
+                decode_size=self._decode_size(self.rotation),
             )
             for s in subset
         }
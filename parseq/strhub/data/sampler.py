@@ -0,0 +1,78 @@
+# Scene Text Recognition Model Hub
+# Copyright 2022 Darwin Bautista
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+from collections.abc import Iterable, Iterator, Sequence
+
+import numpy as np
+
+import torch
+from torch.utils.data import BatchSampler, ConcatDataset, Dataset
+
+log = logging.getLogger(__name__)
+
+
+def get_label_lengths(dataset: Dataset) -> np.ndarray:
+    """Returns the label length of each sample of an LmdbDataset (or a ConcatDataset of LmdbDatasets)."""
+    if isinstance(dataset, ConcatDataset):
+        return np.concatenate([get_label_lengths(d) for d in dataset.datasets])
+    return dataset.label_lengths()
+
+
+class BucketBatchSampler(BatchSampler):
+    """Groups samples with similar label lengths into the same batch to minimize padding.
+
+    Indices drawn from `sampler` (e.g. a RandomSampler or DistributedSampler) are split into pools of
+    `bucket_size_multiplier` batches. Each pool is sorted by label length then split into batches, and finally
+    the order of all the batches is shuffled. Since the sort is stable, samples with the same label length still
+    appear in random order. Because it follows the BatchSampler interface, Lightning can swap in a DistributedSampler
+    for DDP training.
+    """
+
+    def __init__(
+        self,
+        sampler: Iterable[int],
+        batch_size: int,
+        drop_last: bool,
+        lengths: Sequence[int],
+        bucket_size_multiplier: int = 100,
+    ) -> None:
+        super().__init__(sampler, batch_size, drop_last)
+        self.lengths = np.asarray(lengths)
+        self.bucket_size_multiplier = bucket_size_multiplier
+        self.padding_ratio = 0.0
+
+    def _padding_ratio(self, batches: list[np.ndarray]) -> float:
+        # +2 for [B] and [E] which are added by the Tokenizer
+        total = sum(len(b) * (self.lengths[b].max() + 2) for b in batches)
+        used = sum(self.lengths[b].sum() + 2 * len(b) for b in batches)
+        return 1 - used / max(total, 1)
+
+    def __iter__(self) -> Iterator[list[int]]:
+        indices = np.fromiter(self.sampler, dtype=np.int64)
+        if self.drop_last:
+            indices = indices[: len(indices) - len(indices) % self.batch_size]
+        pool_size = self.batch_size * self.bucket_size_multiplier
+        batches = []
+        for i in range(0, len(indices), pool_size):
+            pool = indices[i : i + pool_size]
+            pool = pool[np.argsort(self.lengths[pool], kind='stable')]
+            batches.extend(np.split(pool, range(self.batch_size, len(pool), self.batch_size)))
+        self.padding_ratio = self._padding_ratio(batches)
+        unbucketed = np.split(indices, range(self.batch_size, len(indices), self.batch_size))
+        unbucketed_ratio = self._padding_ratio(unbucketed)
+        log.info(f'Padding ratio: {100 * self.padding_ratio:.2f}% (w/o bucketing: {100 * unbucketed_ratio:.2f}%)')
+        for i in torch.randperm(len(batches)).tolist():
+            yield batches[i].tolist()
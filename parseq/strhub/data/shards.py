@@ -0,0 +1,204 @@
+# Scene Text Recognition Model Hub
+# Copyright 2022 Darwin Bautista
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Sharded dataset format which is read sequentially, one shard at a time.
+
+Each shard is an uncompressed tar archive (shard-NNNNN.tar) which holds the encoded images as consecutive members
+named after their position within the shard (NNNNNNNNN.img). It comes with a JSON index (shard-NNNNN.json):
+    {"num_samples": n, "labels": [...], "dims": [[w, h], ...]}
+The labels are stored as-is, so the same shards can be used with any charset and preprocessing options.
+Shards are searched recursively, so the directory structure of an LMDB tree can be kept as is.
+Use tools/lmdb_to_shards.py to convert existing LMDBs.
+"""
+import glob
+import json
+import logging
+import os
+import tarfile
+from pathlib import Path, PurePath
+from typing import Callable, Iterable, Iterator, Optional, Union
+
+import numpy as np
+
+import torch.distributed as dist
+from torch.utils.data import IterableDataset, get_worker_info
+
+from strhub.data.dataset import decode_image, preprocess_label
+from strhub.data.utils import CharsetAdapter
+
+log = logging.getLogger(__name__)
+
+SHARD_PREFIX = 'shard-'
+# Shards are read in large sequential chunks.
+_READ_BUFFER_SIZE = 16 * 1024 * 1024
+
+
+def shard_name(index: int) -> str:
+    return f'{SHARD_PREFIX}{index:05d}'
+
+
+def member_name(index: int) -> str:
+    return f'{index:09d}.img'
+
+
+def _dist_info() -> tuple[int, int]:
+    if dist.is_available() and dist.is_initialized():
+        return dist.get_rank(), dist.get_world_size()
+    return int(os.environ.get('RANK', 0)), int(os.environ.get('WORLD_SIZE', 1))
+
+
+class ShardDataset(IterableDataset):
+    """Streams the samples of all the shards found under `root`.
+
+    The shards are split across the DataLoader workers (`num_workers`) of all the DDP processes, so there should be at
+    least as many shards as workers in total. Every epoch, each worker reads its shards in a different order, one after
+    the other, and shuffles the samples using a buffer of `shuffle_buffer` samples. Each worker yields the same number
+    of samples, a multiple of `batch_size`, so that all the processes yield the same number of (full) batches.
+    Note that the epoch counter lives in the DataLoader workers, so `persistent_workers` should be enabled.
+
+    Labels are preprocessed and filtered, and images decoded, in the same way as in LmdbDataset.
+    """
+
+    def __init__(
+        self,
+        root: Union[PurePath, str],
+        charset: str,
+        max_label_len: int,
+        min_image_dim: int = 0,
+        remove_whitespace: bool = True,
+        normalize_unicode: bool = True,
+        shuffle_buffer: int = 5000,
+        seed: int = 0,
+        transform: Optional[Callable] = None,
+        decode_size: Optional[tuple[int, int]] = None,
+        batch_size: int = 1,
+        num_workers: int = 0,
+    ):
+        self.root = Path(root).absolute()
+        self.charset = charset
+        self.max_label_len = max_label_len
+        self.min_image_dim = min_image_dim
+        self.remove_whitespace = remove_whitespace
+        self.normalize_unicode = normalize_unicode
+        self.shuffle_buffer = shuffle_buffer
+        self.seed = seed
+        self.transform = transform
+        self.decode_size = decode_size
+        self.batch_size = batch_size
+        self.num_workers = num_workers
+        self._epoch = 0
+        self._plan = None
+        self.shards = sorted(glob.glob(str(self.root / '**' / f'{SHARD_PREFIX}*.tar'), recursive=True))
+        if not self.shards:
+            raise FileNotFoundError(f'No shards found under {self.root}')
+        # Number of samples in each shard which remain after filtering.
+        self.shard_sizes = np.array([len(self._filter_shard(s)[0]) for s in self.shards], dtype=np.int64)
+        log.info(f'dataset root:\t{self.root}\tnum shards: {len(self.shards)}\tnum samples: {self.shard_sizes.sum()}')
+
+    def _filter_shard(self, shard: str) -> tuple[list[int], list[str]]:
+        """Returns the positions and the preprocessed labels of the samples of `shard` which pass the filters."""
+        with open(Path(shard).with_suffix('.json'), 'r') as f:
+            index = json.load(f)
+        charset_adapter = CharsetAdapter(self.charset)
+        positions = []
+        labels = []
+        for i, label in enumerate(index['labels']):
+            label = preprocess_label(
+                label, charset_adapter, self.remove_whitespace, self.normalize_unicode, self.max_label_len
+            )
+            if not label:
+                continue
+            if self.min_image_dim > 0:
+                w, h = index['dims'][i]
+                if w < self.min_image_dim or h < self.min_image_dim:
+                    continue
+            positions.append(i)
+            labels.append(label)
+        return positions, labels
+
+    def _rank_plan(self) -> tuple[int, list[np.ndarray], int]:
+        """The shards assigned to each DataLoader worker of this process, and the number of samples each worker yields.
+        Fixed for all epochs."""
+        if self._plan is None:
+            rank, world_size = _dist_info()
+            num_workers = max(1, self.num_workers)
+            num_streams = world_size * num_workers
+            if num_streams > len(self.shards):
+                raise ValueError(
+                    f'{len(self.shards)} shards cannot be split across {world_size} processes x {num_workers} workers'
+                )
+            order = np.random.default_rng(self.seed).permutation(len(self.shards))
+            streams = [order[i::num_streams] for i in range(num_streams)]
+            # All processes should yield the same number of batches, otherwise DDP would hang. Each worker yields its
+            # own last batch, so the number of samples per worker is the same everywhere, and rounded down to a multiple
+            # of the batch size. The excess samples of the last shards are dropped.
+            num_samples = min(self.shard_sizes[s].sum() for s in streams) // self.batch_size * self.batch_size
+            self._plan = rank, streams[rank * num_workers : (rank + 1) * num_workers], int(num_samples)
+        return self._plan
+
+    def __len__(self):
+        _, streams, num_samples = self._rank_plan()
+        return len(streams) * num_samples
+
+    def _read_shards(self, shards: Iterable[int], quota: Iterable[int]) -> Iterator[tuple[bytes, str]]:
+        for shard, n in zip(shards, quota):
+            if n == 0:
+                continue
+            path = self.shards[shard]
+            positions, labels = self._filter_shard(path)
+            keep = dict(zip(positions[:n], labels[:n]))
+            with open(path, 'rb', buffering=_READ_BUFFER_SIZE) as f, tarfile.open(fileobj=f, mode='r|') as tar:
+                # Streaming mode: the members are read in order, and the data of skipped members is read past.
+                for member in tar:
+                    label = keep.pop(int(member.name.split('.')[0]), None)
+                    if label is None:
+                        continue
+                    yield tar.extractfile(member).read(), label
+                    if not keep:
+                        break
+
+    @staticmethod
+    def _shuffle(samples: Iterable, size: int, rng: np.random.Generator) -> Iterator:
+        buffer = []
+        for sample in samples:
+            if len(buffer) < size:
+                buffer.append(sample)
+                continue
+            i = rng.integers(size)
+            yield buffer[i]
+            buffer[i] = sample
+        rng.shuffle(buffer)
+        yield from buffer
+
+    def __iter__(self):
+        rank, streams, num_samples = self._rank_plan()
+        worker = get_worker_info()
+        worker_id, num_workers = (0, 1) if worker is None else (worker.id, worker.num_workers)
+        if num_workers != len(streams):
+            raise RuntimeError(f'The dataset is split for {len(streams)} DataLoader workers, got {num_workers}')
+        epoch = self._epoch
+        self._epoch += 1
+        rng = np.random.default_rng((self.seed, epoch, rank, worker_id))
+        shards = rng.permutation(streams[worker_id])
+        sizes = self.shard_sizes[shards]
+        quota = np.clip(num_samples - (np.cumsum(sizes) - sizes), 0, sizes)
+        samples = self._read_shards(shards, quota)
+        if self.shuffle_buffer > 1:
+            samples = self._shuffle(samples, self.shuffle_buffer, rng)
+        for imgbuf, label in samples:
+            img = decode_image(imgbuf, self.decode_size)
+            if self.transform is not None:
+                img = self.transform(img)
+            yield img, label
@@ -15,8 +15,7 @@
 
 import re
 from abc import ABC, abstractmethod
-from itertools import groupby
-from typing import Optional
+from typing import Optional, Union
 
 import torch
 from torch import Tensor
@@ -47,10 +46,15 @@ class BaseTokenizer(ABC):
     def __init__(self, charset: str, specials_first: tuple = (), specials_last: tuple = ()) -> None:
         self._itos = specials_first + tuple(charset) + specials_last
         self._stoi = {s: i for i, s in enumerate(self._itos)}
+        self._charset_ids = range(len(specials_first), len(specials_first) + len(charset))
 
     def __len__(self):
         return len(self._itos)
 
+    def charset_items(self) -> list[tuple[int, str]]:
+        """Token ids and characters of the charset, i.e. without the special tokens."""
+        return [(i, self._itos[i]) for i in self._charset_ids]
+
     def _tok2ids(self, tokens: str) -> list[int]:
         return [self._stoi[s] for s in tokens]
 
@@ -72,31 +76,67 @@ class BaseTokenizer(ABC):
         raise NotImplementedError
 
     @abstractmethod
-    def _filter(self, probs: Tensor, ids: Tensor) -> tuple[Tensor, list[int]]:
-        """Internal method which performs the necessary filtering prior to decoding."""
+    def _filter(self, probs: Tensor, ids: Tensor) -> tuple[Tensor, Tensor, Tensor]:
+        """Internal method which performs the necessary filtering prior to decoding, for the whole batch at once.
+
+        Returns:
+            the filtered token ids, moved to the front of each sequence. Shape: N, L
+            the number of filtered token ids of each sequence. Shape: N
+            the number of probabilities (from the start) which make up each sequence probability. Shape: N
+        """
         raise NotImplementedError
 
-    def decode(self, token_dists: Tensor, raw: bool = False) -> tuple[list[str], list[Tensor]]:
+    def decode(
+        self, token_dists: Tensor, raw: bool = False, return_confidence: bool = False
+    ) -> Union[tuple[list[str], list[Tensor]], tuple[list[str], list[Tensor], Tensor]]:
         """Decode a batch of token distributions.
 
         Args:
             token_dists: softmax probabilities over the token distribution. Shape: N, L, C
             raw: return unprocessed labels (will return list of list of strings)
+            return_confidence: also return the sequence probabilities (products), computed on the device
 
         Returns:
             list of string labels (arbitrary length) and
             their corresponding sequence probabilities as a list of Tensors
+            (optional) the products of the sequence probabilities. Shape: N
         """
-        batch_tokens = []
-        batch_probs = []
-        for dist in token_dists:
-            probs, ids = dist.max(-1)  # greedy selection
-            if not raw:
-                probs, ids = self._filter(probs, ids)
-            tokens = self._ids2tok(ids, not raw)
-            batch_tokens.append(tokens)
-            batch_probs.append(probs)
-        return batch_tokens, batch_probs
+        probs, ids = token_dists.max(-1)  # greedy selection
+        if raw:
+            batch_tokens = [self._ids2tok(x, False) for x in ids.tolist()]
+            batch_probs = list(probs)
+            num_probs = torch.full_like(ids[:, 0], ids.shape[1])
+        else:
+            # Filtering is done on the device. Only the compact result is transferred to the host, all at once.
+            ids, num_ids, num_probs = self._filter(probs, ids)
+            batch_tokens = []
+            batch_probs = []
+            for (n, m, *x), p in zip(torch.cat([num_ids[:, None], num_probs[:, None], ids], dim=1).tolist(), probs):
+                batch_tokens.append(self._ids2tok(x[:n]))
+                batch_probs.append(p[:m])
+        if not return_confidence:
+            return batch_tokens, batch_probs
+        return batch_tokens, batch_probs, self._sequence_probs(probs, num_probs)
+
+    def decode_on_device(self, token_dists: Tensor) -> tuple[Tensor, Tensor, Tensor]:
+        """Like decode(), but the output stays on the device, as tensors. No host sync is needed.
+
+        Args:
+            token_dists: softmax probabilities over the token distribution. Shape: N, L, C
+
+        Returns:
+            token ids of the labels, at the start of each row (the rest is undefined). Shape: N, L
+            label lengths. Shape: N
+            sequence probabilities (products). Shape: N
+        """
+        probs, ids = token_dists.max(-1)  # greedy selection
+        ids, num_ids, num_probs = self._filter(probs, ids)
+        return ids, num_ids, self._sequence_probs(probs, num_probs)
+
+    @staticmethod
+    def _sequence_probs(probs: Tensor, num_probs: Tensor) -> Tensor:
+        positions = torch.arange(probs.shape[1], device=probs.device)
+        return probs.masked_fill(positions >= num_probs[:, None], 1.0).prod(-1)
 
 
 class Tokenizer(BaseTokenizer):
@@ -117,16 +157,13 @@ class Tokenizer(BaseTokenizer):
         ]
         return pad_sequence(batch, batch_first=True, padding_value=self.pad_id)
 
-    def _filter(self, probs: Tensor, ids: Tensor) -> tuple[Tensor, list[int]]:
-        ids = ids.tolist()
-        try:
-            eos_idx = ids.index(self.eos_id)
-        except ValueError:
-            eos_idx = len(ids)  # Nothing to truncate.
-        # Truncate after EOS
-        ids = ids[:eos_idx]
-        probs = probs[: eos_idx + 1]  # but include prob. for EOS (if it exists)
-        return probs, ids
+    def _filter(self, probs: Tensor, ids: Tensor) -> tuple[Tensor, Tensor, Tensor]:
+        L = ids.shape[1]
+        eos = ids == self.eos_id
+        # Index of the first EOS, or L if there is none (nothing to truncate).
+        eos_idx = torch.where(eos.any(-1), eos.int().argmax(-1), L)
+        # Truncate after EOS, but include prob. for EOS (if it exists)
+        return ids, eos_idx, (eos_idx + 1).clamp_(max=L)
 
 
 class CTCTokenizer(BaseTokenizer):
@@ -142,9 +179,13 @@ class CTCTokenizer(BaseTokenizer):
         batch = [torch.as_tensor(self._tok2ids(y), dtype=torch.long, device=device) for y in labels]
         return pad_sequence(batch, batch_first=True, padding_value=self.blank_id)
 
-    def _filter(self, probs: Tensor, ids: Tensor) -> tuple[Tensor, list[int]]:
+    def _filter(self, probs: Tensor, ids: Tensor) -> tuple[Tensor, Tensor, Tensor]:
         # Best path decoding:
-        ids = list(zip(*groupby(ids.tolist())))[0]  # Remove duplicate tokens
-        ids = [x for x in ids if x != self.blank_id]  # Remove BLANKs
+        keep = torch.ones_like(ids, dtype=torch.bool)
+        keep[:, 1:] = ids[:, 1:] != ids[:, :-1]  # Remove duplicate tokens
+        keep &= ids != self.blank_id  # Remove BLANKs
+        # Move the remaining tokens to the front, in order.
+        order = torch.sort((~keep).int(), dim=-1, stable=True).indices
         # `probs` is just pass-through since all positions are considered part of the path
-        return probs, ids
+        num_probs = torch.full_like(ids[:, 0], ids.shape[1])
+        return ids.gather(1, order), keep.sum(-1), num_probs
@@ -0,0 +1,7 @@
+def __getattr__(name):
+    # Imported lazily, so that importing strhub.models (e.g. for training) doesn't import torch.fx.
+    if name == 'optimize_for_inference':
+        from .optimize import optimize_for_inference
+
+        return optimize_for_inference
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
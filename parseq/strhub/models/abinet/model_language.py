@@ -18,6 +18,7 @@ class BCNLanguage(Model):
                                                 activation, self_attn=use_self_attn, debug=global_debug)
         self.model = TransformerDecoder(decoder_layer, num_layers)
         self.cls = nn.Linear(d_model, num_classes)
+        self.output_logits = True
 
     def forward(self, tokens, lengths):
         """
@@ -41,8 +42,11 @@ class BCNLanguage(Model):
                             memory_key_padding_mask=padding_mask)  # (T, N, E)
         output = output.permute(1, 0, 2)  # (N, T, E)
 
-        logits = self.cls(output)  # (N, T, C)
-        pt_lengths = self._get_length(logits)
+        if self.output_logits:
+            logits = self.cls(output)  # (N, T, C)
+            pt_lengths = self._get_length(logits)
+        else:
+            logits = pt_lengths = None
 
         res = {'feature': output, 'logits': logits, 'pt_lengths': pt_lengths,
                'loss_weight': self.loss_weight, 'name': 'language'}
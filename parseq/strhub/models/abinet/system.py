@@ -109,6 +109,17 @@ class ABINet(CrossEntropySystem):
         total_steps = self.trainer.estimated_stepping_batches * self.trainer.accumulate_grad_batches
         return self.global_step < (8 / (8 + 10)) * total_steps
 
+    @property
+    def quantizable_modules(self) -> tuple[str, ...]:
+        # The ResNet-45 of the vision model, without the transformer layers on top of it (if any).
+        if hasattr(self.model.vision.backbone, 'resnet'):
+            return ('model.vision.backbone.resnet',)
+        return ('model.vision.backbone',)
+
+    def strip_for_inference(self) -> None:
+        # Only the features of the language model are used (by the alignment model) at inference.
+        self.model.language.output_logits = False
+
     @torch.jit.ignore
     def no_weight_decay(self):
         return {'model.language.proj.weight'}
@@ -18,8 +18,6 @@ from abc import ABC, abstractmethod
 from dataclasses import dataclass
 from typing import Optional
 
-from nltk import edit_distance
-
 import torch
 import torch.nn.functional as F
 from torch import Tensor
@@ -35,11 +33,12 @@ from strhub.data.utils import BaseTokenizer, CharsetAdapter, CTCTokenizer, Token
 
 @dataclass
 class BatchResult:
+    # The metrics are 0-dim tensors on the device, so that the evaluation loop doesn't have to sync every batch.
     num_samples: int
-    correct: int
-    ned: float
-    confidence: float
-    label_length: int
+    correct: Tensor
+    ned: Tensor
+    confidence: Tensor
+    label_length: Tensor
     loss: Tensor
     loss_numel: int
 
@@ -47,7 +46,31 @@ class BatchResult:
 EPOCH_OUTPUT = list[dict[str, BatchResult]]
 
 
+def edit_distance(a: Tensor, a_lens: Tensor, b: Tensor, b_lens: Tensor) -> Tensor:
+    """Batched Levenshtein distance between the padded sequences a[i, :a_lens[i]] and b[i, :b_lens[i]].
+
+    The DP table is computed one row (i.e. one element of `a`) at a time, for the whole batch. Within a row, the
+    insertion term D[i, j] = D[i, j - 1] + 1 is resolved with a cumulative min.
+    """
+    cols = torch.arange(b.shape[1] + 1, device=b.device)
+    row = cols.expand(a.shape[0], -1)  # D[0, j] = j
+    b_lens = b_lens.unsqueeze(1)
+    dist = row.gather(1, b_lens).squeeze(1)
+    for i in range(a.shape[1]):
+        # Deletion, then substitution (or match)
+        cur = row + 1
+        cur[:, 1:] = torch.minimum(cur[:, 1:], row[:, :-1] + (a[:, i : i + 1] != b))
+        # Insertion: D[i, j] = min over k <= j of (cur[k] + j - k)
+        row = (cur - cols).cummin(-1).values + cols
+        dist = torch.where(a_lens == i + 1, row.gather(1, b_lens).squeeze(1), dist)
+    return dist
+
+
 class BaseSystem(pl.LightningModule, ABC):
+    # Qualified names of the convolutional feature extractors, which are quantized by
+    # strhub.models.utils.quantize_static() and optimized by strhub.models.optimize_for_inference().
+    # They must be traceable with torch.fx.
+    quantizable_modules: tuple[str, ...] = ()
 
     def __init__(
         self,
@@ -61,11 +84,32 @@ class BaseSystem(pl.LightningModule, ABC):
         super().__init__()
         self.tokenizer = tokenizer
         self.charset_adapter = CharsetAdapter(charset_test)
+        # The evaluation metrics are computed on token ids, common to the predictions and the ground truth labels:
+        # the test charset, extended with any other label character seen.
+        self._eval_vocab = {c: i for i, c in enumerate(dict.fromkeys(charset_test))}
+        adapted = {i: self.charset_adapter(c) for i, c in tokenizer.charset_items()}
+        if all(len(c) <= 1 for c in adapted.values()):
+            # Predicted token id -> evaluation token id, or -1 if removed by charset_adapter.
+            eval_ids = torch.full((len(tokenizer),), -1, dtype=torch.long)
+            for i, c in adapted.items():
+                if c:
+                    eval_ids[i] = self._eval_vocab.setdefault(c, len(self._eval_vocab))
+        else:
+            # Some characters are mapped to several ones (e.g. by case conversion). Adapt the predicted strings.
+            eval_ids = None
+        self.register_buffer('_eval_ids', eval_ids, persistent=False)
         self.batch_size = batch_size
         self.lr = lr
         self.warmup_pct = warmup_pct
         self.weight_decay = weight_decay
         self.outputs: EPOCH_OUTPUT = []
+        # Inference without data-dependent control flow or shapes (e.g. fixed-length decoding, no host syncs).
+        # Required by graph capture (see strhub.models.utils.compile_model()).
+        self.static_shapes = False
+
+    def strip_for_inference(self) -> None:
+        """Disable the computations which don't contribute to the output of forward(). Called by
+        strhub.models.optimize_for_inference(). Training isn't possible afterwards."""
 
     @abstractmethod
     def forward(self, images: Tensor, max_length: Optional[int] = None) -> Tensor:
@@ -109,14 +153,17 @@ class BaseSystem(pl.LightningModule, ABC):
     def optimizer_zero_grad(self, epoch: int, batch_idx: int, optimizer: Optimizer) -> None:
         optimizer.zero_grad(set_to_none=True)
 
+    def _encode_eval(self, labels: list[str]) -> tuple[Tensor, Tensor]:
+        """Evaluation token ids (padded) and lengths of `labels`, transferred to the device in one go."""
+        vocab = self._eval_vocab
+        ids = [[vocab.setdefault(c, len(vocab)) for c in label] for label in labels]
+        max_len = max(map(len, ids))
+        ids = torch.tensor([[len(x)] + x + [-1] * (max_len - len(x)) for x in ids]).to(self.device, non_blocking=True)
+        return ids[:, 1:], ids[:, 0]
+
     def _eval_step(self, batch, validation: bool) -> Optional[STEP_OUTPUT]:
         images, labels = batch
 
-        correct = 0
-        total = 0
-        ned = 0
-        confidence = 0
-        label_length = 0
         if validation:
             logits, loss, loss_numel = self.forward_logits_loss(images, labels)
         else:
@@ -130,17 +177,24 @@ class BaseSystem(pl.LightningModule, ABC):
             loss = loss_numel = None  # Only used for validation; not needed at test-time.
 
         probs = logits.softmax(-1)
-        preds, probs = self.tokenizer.decode(probs)
-        for pred, prob, gt in zip(preds, probs, labels):
-            confidence += prob.prod().item()
-            pred = self.charset_adapter(pred)
-            # Follow ICDAR 2019 definition of N.E.D.
-            ned += edit_distance(pred, gt) / max(len(pred), len(gt))
-            if pred == gt:
-                correct += 1
-            total += 1
-            label_length += len(pred)
-        return dict(output=BatchResult(total, correct, ned, confidence, label_length, loss, loss_numel))
+        if self._eval_ids is None:
+            preds, _, confidence = self.tokenizer.decode(probs, return_confidence=True)
+            pred_ids, pred_lens = self._encode_eval([self.charset_adapter(pred) for pred in preds])
+        else:
+            # Everything stays on the device.
+            ids, lens, confidence = self.tokenizer.decode_on_device(probs)
+            ids = self._eval_ids[ids]
+            # Remove the characters dropped by charset_adapter (and the positions past the label length).
+            keep = (ids >= 0) & (torch.arange(ids.shape[1], device=ids.device) < lens.unsqueeze(1))
+            pred_ids = ids.gather(1, torch.sort((~keep).int(), dim=-1, stable=True).indices)
+            pred_lens = keep.sum(-1)
+        gt_ids, gt_lens = self._encode_eval(labels)
+        dist = edit_distance(pred_ids, pred_lens, gt_ids, gt_lens)
+        # Follow ICDAR 2019 definition of N.E.D.
+        ned = (dist / torch.maximum(pred_lens, gt_lens)).sum()
+        correct = (dist == 0).sum()
+        result = BatchResult(len(labels), correct, ned, confidence.sum(), pred_lens.sum(), loss, loss_numel)
+        return dict(output=result)
 
     @staticmethod
     def _aggregate_results(outputs: EPOCH_OUTPUT) -> tuple[float, float, float]:
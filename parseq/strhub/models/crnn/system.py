@@ -26,6 +26,7 @@ from .model import CRNN as Model
 
 
 class CRNN(CTCSystem):
+    quantizable_modules = ('model.cnn',)
 
     def __init__(
         self,
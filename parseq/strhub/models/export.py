@@ -0,0 +1,95 @@
+# Scene Text Recognition Model Hub
+# Copyright 2022 Darwin Bautista
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""ONNX export of the models, and inference with ONNX Runtime.
+
+The exported graph maps a batch of normalized images (images: N, 3, H, W) to the logits (logits: N, L, C), with a
+dynamic batch size. Models are exported with static shapes (see BaseSystem.static_shapes), so the autoregressive
+decoding loops (PARSeq AR, TRBA) are unrolled into the graph up to the max. label length. The PARSeq variant
+(AR or NAR, refine_iters) is the one the model is configured with.
+
+There is no ONNX Loop and no separate encoder/decoder-step graphs, so the graph always runs all the max_label_length
++ 1 decoding steps for the whole batch: unlike the PyTorch model, it doesn't stop early once every sequence has an
+<eos>. On the CPU, the latency of ONNX Runtime is still close to that of PyTorch (see tools/export_onnx.py).
+
+Requires the onnx and onnxruntime packages, which are imported only when needed.
+"""
+from pathlib import PurePath
+from typing import Optional, Union
+
+import numpy as np
+
+import torch
+from torch import Tensor
+
+INPUT_NAME = 'images'
+OUTPUT_NAME = 'logits'
+
+
+@torch.no_grad()
+def export_onnx(model, path: Union[PurePath, str], opset_version: int = 17) -> None:
+    """Export the inference path (forward()) of `model` to `path`."""
+    static_shapes = model.static_shapes
+    model.eval()
+    model.static_shapes = True
+    h, w = model.hparams.img_size
+    images = torch.rand(2, 3, h, w, device=model.device)
+    try:
+        torch.onnx.export(
+            model,
+            (images,),
+            str(path),
+            input_names=[INPUT_NAME],
+            output_names=[OUTPUT_NAME],
+            dynamic_axes={INPUT_NAME: {0: 'batch'}, OUTPUT_NAME: {0: 'batch'}},
+            opset_version=opset_version,
+        )
+    finally:
+        model.static_shapes = static_shapes
+
+
+class OnnxRuntimeModel:
+    """Runs an exported model with ONNX Runtime on the CPU.
+
+    IO binding is used, so the input is read directly from the memory of the images tensor (no copy).
+    """
+
+    def __init__(self, path: Union[PurePath, str], num_threads: Optional[int] = None) -> None:
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads is not None:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(str(path), options, providers=['CPUExecutionProvider'])
+
+    def __call__(self, images: Tensor, max_length: Optional[int] = None) -> Tensor:
+        """Same interface as BaseSystem.forward(). max_length is ignored, the graph decodes up to the max. length."""
+        images = images.detach().to('cpu', torch.float32).contiguous()
+        binding = self.session.io_binding()
+        binding.bind_input(INPUT_NAME, 'cpu', 0, np.float32, tuple(images.shape), images.data_ptr())
+        binding.bind_output(OUTPUT_NAME, 'cpu')
+        self.session.run_with_iobinding(binding)
+        return torch.from_numpy(binding.copy_outputs_to_cpu()[0])
+
+
+def use_onnx_runtime(model, path: Union[PurePath, str], num_threads: Optional[int] = None):
+    """Replace the forward() of `model` (kept for its tokenizer, evaluation and hparams) by the exported graph.
+
+    The model should be on the CPU, since the output of the graph is.
+    """
+    model.static_shapes = True
+    model.forward = OnnxRuntimeModel(path, num_threads)
+    return model
@@ -0,0 +1,70 @@
+# Scene Text Recognition Model Hub
+# Copyright 2022 Darwin Bautista
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Inference-only graph optimizations which don't change the output of the models (up to floating-point error)."""
+from typing import Optional
+
+import torch
+from torch import Tensor, nn
+from torch.fx.experimental.optimization import fuse
+
+from .utils import _set_submodule
+
+
+class ChannelsLast(nn.Module):
+    """Runs `module` (e.g. a CNN) in the channels_last memory format, with contiguous (NCHW) input and output."""
+
+    def __init__(self, module: nn.Module) -> None:
+        super().__init__()
+        self.module = module.to(memory_format=torch.channels_last)
+
+    def forward(self, x: Tensor) -> Tensor:
+        return self.module(x.contiguous(memory_format=torch.channels_last)).contiguous()
+
+
+@torch.no_grad()
+def optimize_for_inference(
+    model,
+    channels_last: bool = True,
+    check_images: Optional[Tensor] = None,
+    rtol: float = 1e-4,
+    atol: float = 1e-4,
+):
+    """Optimize `model` (in place) for inference. Training isn't possible afterwards.
+
+    - The BatchNorm layers of the convolutional feature extractors (see BaseSystem.quantizable_modules) are folded
+      into the preceding convolutions.
+    - The Dropout layers, which are no-ops in eval mode, are removed.
+    - The computations which don't contribute to the output are disabled (see BaseSystem.strip_for_inference()),
+      e.g. the classifier of the ABINet language model.
+    - If `channels_last` is True, the convolutional feature extractors are run in the channels_last memory format,
+      which is the faster one for the CPU (oneDNN) kernels, and on the GPU with reduced precision.
+
+    If `check_images` (a batch of normalized images) is given, the output (logits) for these images is checked against
+    the one of the original model (with torch.testing.assert_close()).
+    """
+    model.eval().requires_grad_(False)
+    if check_images is not None:
+        expected = model(check_images)
+    for name in model.quantizable_modules:
+        module = fuse(model.get_submodule(name))
+        _set_submodule(model, name, ChannelsLast(module) if channels_last else module)
+    for name, module in list(model.named_modules()):
+        if isinstance(module, nn.Dropout):
+            _set_submodule(model, name, nn.Identity())
+    model.strip_for_inference()
+    if check_images is not None:
+        torch.testing.assert_close(model(check_images), expected, rtol=rtol, atol=atol)
+    return model
@@ -46,12 +46,18 @@ class PARSeq(nn.Module):
         decode_ar: bool,
         refine_iters: int,
         dropout: float,
+        kv_cache: bool = True,
+        cascade_threshold: Optional[float] = None,
+        speculative: bool = False,
     ) -> None:
         super().__init__()
 
         self.max_label_length = max_label_length
         self.decode_ar = decode_ar
         self.refine_iters = refine_iters
+        self.kv_cache = kv_cache
+        self.cascade_threshold = cascade_threshold
+        self.speculative = speculative
 
         self.encoder = Encoder(
             img_size, patch_size, embed_dim=embed_dim, depth=enc_depth, num_heads=enc_num_heads, mlp_ratio=enc_mlp_ratio
@@ -66,6 +72,17 @@ class PARSeq(nn.Module):
         # +1 for <eos>
         self.pos_queries = nn.Parameter(torch.Tensor(1, max_label_length + 1, embed_dim))
         self.dropout = nn.Dropout(p=dropout)
+        # Attention masks for the max. number of decoding steps (sliced as needed), so that they aren't rebuilt on
+        # every call. Not part of the state dict.
+        num_steps = max_label_length + 1
+        # Special case for the forward permutation. Faster than using `generate_attn_masks()`
+        ar_mask = torch.triu(torch.ones((num_steps, num_steps), dtype=torch.bool), 1)
+        # For iterative refinement, we always use a 'cloze' mask.
+        # We can derive it from the AR forward mask by unmasking the token context to the right.
+        cloze_mask = ar_mask.clone()
+        cloze_mask[torch.triu(torch.ones((num_steps, num_steps), dtype=torch.bool), 2)] = 0
+        self.register_buffer('ar_mask', ar_mask, persistent=False)
+        self.register_buffer('cloze_mask', cloze_mask, persistent=False)
         # Encoder has its own init.
         named_apply(partial(init_weights, exclude=['encoder']), self)
         nn.init.trunc_normal_(self.pos_queries, std=0.02)
@@ -91,7 +108,10 @@ class PARSeq(nn.Module):
         tgt_padding_mask: Optional[Tensor] = None,
         tgt_query: Optional[Tensor] = None,
         tgt_query_mask: Optional[Tensor] = None,
+        memory_kv: Optional[list] = None,
+        need_weights: bool = False,
     ):
+        """If need_weights is set, the cross-attention weights are returned as well (see Decoder.forward())."""
         N, L = tgt.shape
         # <bos> stands for the null context. We only supply position information for characters after <bos>.
         null_ctx = self.text_embed(tgt[:, :1])
@@ -100,33 +120,69 @@ class PARSeq(nn.Module):
         if tgt_query is None:
             tgt_query = self.pos_queries[:, :L].expand(N, -1, -1)
         tgt_query = self.dropout(tgt_query)
-        return self.decoder(tgt_query, tgt_emb, memory, tgt_query_mask, tgt_mask, tgt_padding_mask)
+        return self.decoder(
+            tgt_query, tgt_emb, memory, tgt_query_mask, tgt_mask, tgt_padding_mask, memory_kv, need_weights
+        )
 
-    def forward(self, tokenizer: Tokenizer, images: Tensor, max_length: Optional[int] = None) -> Tensor:
-        testing = max_length is None
-        max_length = self.max_label_length if max_length is None else min(max_length, self.max_label_length)
-        bs = images.shape[0]
-        # +1 for <eos> at end of sequence.
-        num_steps = max_length + 1
-        memory = self.encode(images)
+    def decode_step(
+        self,
+        tgt: torch.Tensor,
+        pos: int,
+        memory: torch.Tensor,
+        tgt_query: Tensor,
+        cache: list,
+        memory_kv: Optional[list] = None,
+    ):
+        """Incremental decode() for the canonical AR context.
+
+        Only the input token at position `pos` (tgt, shape: N, 1) is processed. The keys and values of the previous
+        positions are taken from `cache` (see Decoder.init_cache()), which is then updated with the ones of `pos`.
+        memory_kv are the precomputed cross-attention keys and values of memory (see Decoder.project_memory()).
+        """
+        tgt_emb = self.text_embed(tgt)
+        # <bos> stands for the null context, so it has no position information.
+        if pos > 0:
+            tgt_emb = self.pos_queries[:, pos - 1 : pos] + tgt_emb
+        tgt_emb = self.dropout(tgt_emb)
+        return self.decoder.forward_cached(self.dropout(tgt_query), tgt_emb, memory, cache, pos, memory_kv)
+
+    @staticmethod
+    def _eos_logits(tokenizer: Tokenizer, shape: Sequence[int], like: Tensor) -> Tensor:
+        """Logits which put all the probability on <eos> (one-hot after softmax), for finished sequences."""
+        logits = like.new_full(shape, torch.finfo(like.dtype).min)
+        logits[..., tokenizer.eos_id] = 0
+        return logits
 
+    def _decode_ar(
+        self, tokenizer: Tokenizer, memory: Tensor, memory_kv: Optional[list], num_steps: int, testing: bool
+    ) -> Tensor:
+        """Greedy AR decoding. When testing, the sequences which are finished (i.e. have an <eos>) are removed from
+        the batch. The positions after their first <eos> aren't decoded, and get _eos_logits() instead of the logits
+        the model would have produced there."""
+        bs = memory.shape[0]
         # Query positions up to `num_steps`
         pos_queries = self.pos_queries[:, :num_steps].expand(bs, -1, -1)
+        tgt_mask = query_mask = self.ar_mask[:num_steps, :num_steps]
 
-        # Special case for the forward permutation. Faster than using `generate_attn_masks()`
-        tgt_mask = query_mask = torch.triu(torch.ones((num_steps, num_steps), dtype=torch.bool, device=self._device), 1)
-
-        if self.decode_ar:
-            tgt_in = torch.full((bs, num_steps), tokenizer.pad_id, dtype=torch.long, device=self._device)
-            tgt_in[:, 0] = tokenizer.bos_id
-
-            logits = []
-            for i in range(num_steps):
-                j = i + 1  # next token index
-                # Efficient decoding:
-                # Input the context up to the ith token. We use only one query (at position = i) at a time.
-                # This works because of the lookahead masking effect of the canonical (forward) AR context.
-                # Past tokens have no access to future tokens, hence are fixed once computed.
+        tgt_in = torch.full((bs, num_steps), tokenizer.pad_id, dtype=torch.long, device=self._device)
+        tgt_in[:, 0] = tokenizer.bos_id
+        if self.kv_cache:
+            cache = self.decoder.init_cache(bs, num_steps, memory.device, memory.dtype)
+        # Indices (in the full batch) of the sequences which are still being decoded.
+        active = torch.arange(bs, device=self._device)
+
+        logits = []
+        for i in range(num_steps):
+            j = i + 1  # next token index
+            n = len(active)
+            # Efficient decoding:
+            # Input the context up to the ith token. We use only one query (at position = i) at a time.
+            # This works because of the lookahead masking effect of the canonical (forward) AR context.
+            # Past tokens have no access to future tokens, hence are fixed once computed.
+            if self.kv_cache:
+                # Even better: only the ith token is processed. The keys and values of the past tokens are cached.
+                tgt_out = self.decode_step(tgt_in[:, i:j], i, memory, pos_queries[:, i:j], cache, memory_kv)
+            else:
                 tgt_out = self.decode(
                     tgt_in[:, :j],
                     memory,
@@ -134,36 +190,178 @@ class PARSeq(nn.Module):
                     tgt_query=pos_queries[:, i:j],
                     tgt_query_mask=query_mask[i:j, :j],
                 )
-                # the next token probability is in the output's ith token position
-                p_i = self.head(tgt_out)
+            # the next token probability is in the output's ith token position
+            p_i = self.head(tgt_out)
+            if n < bs:
+                # Scatter back to the full batch. Finished sequences only predict <eos>.
+                eos_logits = self._eos_logits(tokenizer, (bs, 1, p_i.shape[-1]), p_i)
+                logits.append(eos_logits.index_copy_(0, active, p_i))
+            else:
                 logits.append(p_i)
-                if j < num_steps:
-                    # greedy decode. add the next token index to the target input
-                    tgt_in[:, j] = p_i.squeeze().argmax(-1)
-                    # Efficient batch decoding: If all output words have at least one EOS token, end decoding.
-                    if testing and (tgt_in == tokenizer.eos_id).any(dim=-1).all():
+            if j < num_steps:
+                # greedy decode. add the next token index to the target input
+                tgt_in[:, j] = p_i.squeeze(1).argmax(-1)
+                if testing:
+                    # Efficient batch decoding: sequences with at least one EOS token are removed from the batch.
+                    # Decoding ends once all of them are done.
+                    keep = (tgt_in != tokenizer.eos_id).all(dim=-1).nonzero().squeeze(1)
+                    if not len(keep):
                         break
+                    if len(keep) < n:
+                        active = active[keep]
+                        tgt_in = tgt_in[keep]
+                        pos_queries = pos_queries[keep]
+                        memory = memory[keep]
+                        if memory_kv is not None:
+                            memory_kv = self.decoder.select_kv(memory_kv, keep, n)
+                        if self.kv_cache:
+                            cache = self.decoder.select_kv(cache, keep, n)
 
-            logits = torch.cat(logits, dim=1)
-        else:
-            # No prior context, so input is just <bos>. We query all positions.
-            tgt_in = torch.full((bs, 1), tokenizer.bos_id, dtype=torch.long, device=self._device)
-            tgt_out = self.decode(tgt_in, memory, tgt_query=pos_queries)
+        return torch.cat(logits, dim=1)
+
+    def _decode_speculative(
+        self,
+        tokenizer: Tokenizer,
+        memory: Tensor,
+        memory_kv: Optional[list],
+        num_steps: int,
+        testing: bool,
+        draft: Optional[Tensor] = None,
+    ) -> Tensor:
+        """Greedy AR decoding by parallel verification of a draft (the NAR prediction by default).
+
+        The whole draft is input at once with the canonical AR mask, so the output at each position is the greedy AR
+        prediction given the draft tokens before it. The prefix which agrees with these predictions is accepted, along
+        with the prediction at the first disagreement (its context is correct). The predictions become the next
+        draft, so each pass accepts at least one more token and the output is the same as that of _decode_ar(). As in
+        _decode_ar(), the positions after the first <eos> get _eos_logits() when testing.
+        """
+        bs = memory.shape[0]
+        pos_queries = self.pos_queries[:, :num_steps].expand(bs, -1, -1)
+        tgt_mask = query_mask = self.ar_mask[:num_steps, :num_steps]
+        if draft is None:
+            draft = self._decode_nar(tokenizer, memory, memory_kv, num_steps).argmax(-1)
+        bos = torch.full((bs, 1), tokenizer.bos_id, dtype=torch.long, device=self._device)
+        tgt_in = torch.cat([bos, draft[:, :-1]], dim=1)
+        positions = torch.arange(num_steps, device=self._device)
+        # Indices (in the full batch) of the sequences which are still being decoded.
+        active = torch.arange(bs, device=self._device)
+        logits = None
+        while len(active):
+            n = len(active)
+            tgt_out = self.decode(
+                tgt_in, memory, tgt_mask, tgt_query=pos_queries[:n], tgt_query_mask=query_mask, memory_kv=memory_kv
+            )
+            p = self.head(tgt_out)
+            # Positions which aren't accepted yet are overwritten by the next passes.
+            logits = p if logits is None else logits.index_copy_(0, active, p)
+            pred = p.argmax(-1)
+            mismatch = pred[:, :-1] != tgt_in[:, 1:]
+            # Number of accepted tokens: up to and including the first mismatch.
+            accepted = torch.where(mismatch.any(-1), mismatch.int().argmax(-1) + 1, num_steps)
+            done = accepted == num_steps
+            if testing:
+                done |= ((pred == tokenizer.eos_id) & (positions < accepted.unsqueeze(1))).any(-1)
+            keep = (~done).nonzero().squeeze(1)
+            tgt_in = torch.cat([bos[: len(keep)], pred[keep, :-1]], dim=1)
+            if len(keep) < n:
+                active = active[keep]
+                memory = memory[keep]
+                if memory_kv is not None:
+                    memory_kv = self.decoder.select_kv(memory_kv, keep, n)
+        if testing:
+            eos = logits.argmax(-1) == tokenizer.eos_id
+            after_eos = (eos.cumsum(-1) - eos.int()) > 0
+            eos_logits = self._eos_logits(tokenizer, logits.shape[-1:], logits)
+            logits = torch.where(after_eos.unsqueeze(-1), eos_logits, logits)
+        return logits
+
+    def _decode_nar(self, tokenizer: Tokenizer, memory: Tensor, memory_kv: Optional[list], num_steps: int) -> Tensor:
+        bs = memory.shape[0]
+        pos_queries = self.pos_queries[:, :num_steps].expand(bs, -1, -1)
+        # No prior context, so input is just <bos>. We query all positions.
+        tgt_in = torch.full((bs, 1), tokenizer.bos_id, dtype=torch.long, device=self._device)
+        tgt_out = self.decode(tgt_in, memory, tgt_query=pos_queries, memory_kv=memory_kv)
+        return self.head(tgt_out)
+
+    def _refine(
+        self, tokenizer: Tokenizer, logits: Tensor, memory: Tensor, memory_kv: Optional[list], num_steps: int
+    ) -> Tensor:
+        bs, L = logits.shape[:2]
+        pos_queries = self.pos_queries[:, :num_steps].expand(bs, -1, -1)
+        cloze_mask = self.cloze_mask[:num_steps, :num_steps]
+        bos = torch.full((bs, 1), tokenizer.bos_id, dtype=torch.long, device=self._device)
+        for i in range(self.refine_iters):
+            # Prior context is the previous output.
+            tgt_in = torch.cat([bos, logits[:, :-1].argmax(-1)], dim=1)
+            # Mask tokens beyond the first EOS token.
+            tgt_padding_mask = (tgt_in == tokenizer.eos_id).int().cumsum(-1) > 0
+            tgt_out = self.decode(
+                tgt_in,
+                memory,
+                cloze_mask[:L, :L],
+                tgt_padding_mask,
+                pos_queries,
+                cloze_mask[:, :L],
+                memory_kv,
+            )
             logits = self.head(tgt_out)
+        return logits
 
+    @staticmethod
+    def sequence_confidence(tokenizer: Tokenizer, logits: Tensor) -> Tensor:
+        """Product of the max. probabilities up to and including the first <eos>, same as the Tokenizer output."""
+        probs, ids = logits.softmax(-1).max(-1)
+        eos = ids == tokenizer.eos_id
+        # Positions after the first <eos>
+        after_eos = (eos.cumsum(-1) - eos.int()) > 0
+        return probs.masked_fill(after_eos, 1.0).prod(-1)
+
+    def _decode_cascade(
+        self, tokenizer: Tokenizer, memory: Tensor, memory_kv: Optional[list], num_steps: int, testing: bool
+    ) -> Tensor:
+        """NAR decoding (+ refinement) for the whole batch. Samples with a sequence confidence below the threshold
+        are decoded again, autoregressively (+ refinement)."""
+        logits = self._decode_nar(tokenizer, memory, memory_kv, num_steps)
         if self.refine_iters:
-            # For iterative refinement, we always use a 'cloze' mask.
-            # We can derive it from the AR forward mask by unmasking the token context to the right.
-            query_mask[torch.triu(torch.ones(num_steps, num_steps, dtype=torch.bool, device=self._device), 2)] = 0
-            bos = torch.full((bs, 1), tokenizer.bos_id, dtype=torch.long, device=self._device)
-            for i in range(self.refine_iters):
-                # Prior context is the previous output.
-                tgt_in = torch.cat([bos, logits[:, :-1].argmax(-1)], dim=1)
-                # Mask tokens beyond the first EOS token.
-                tgt_padding_mask = (tgt_in == tokenizer.eos_id).int().cumsum(-1) > 0
-                tgt_out = self.decode(
-                    tgt_in, memory, tgt_mask, tgt_padding_mask, pos_queries, query_mask[:, : tgt_in.shape[1]]
+            logits = self._refine(tokenizer, logits, memory, memory_kv, num_steps)
+        redo = (self.sequence_confidence(tokenizer, logits) < self.cascade_threshold).nonzero().squeeze(1)
+        if len(redo):
+            memory_kv_redo = None if memory_kv is None else self.decoder.select_kv(memory_kv, redo, len(memory))
+            if self.speculative:
+                # The NAR prediction is the draft.
+                logits_ar = self._decode_speculative(
+                    tokenizer, memory[redo], memory_kv_redo, num_steps, testing, logits[redo].argmax(-1)
                 )
-                logits = self.head(tgt_out)
+            else:
+                logits_ar = self._decode_ar(tokenizer, memory[redo], memory_kv_redo, num_steps, testing)
+            if self.refine_iters:
+                logits_ar = self._refine(tokenizer, logits_ar, memory[redo], memory_kv_redo, num_steps)
+            # AR decoding might have stopped early. Pad with <eos>.
+            pad_shape = (len(redo), logits.shape[1] - logits_ar.shape[1], logits.shape[2])
+            logits[redo] = torch.cat([logits_ar, self._eos_logits(tokenizer, pad_shape, logits_ar)], dim=1)
+        return logits
+
+    def forward(self, tokenizer: Tokenizer, images: Tensor, max_length: Optional[int] = None) -> Tensor:
+        testing = max_length is None
+        max_length = self.max_label_length if max_length is None else min(max_length, self.max_label_length)
+        # +1 for <eos> at end of sequence.
+        num_steps = max_length + 1
+        memory = self.encode(images)
+        # The cross-attention keys and values of memory are the same for all decoding steps and refinement iterations.
+        memory_kv = self.decoder.project_memory(memory) if self.kv_cache else None
+
+        if self.cascade_threshold is not None:
+            return self._decode_cascade(tokenizer, memory, memory_kv, num_steps, testing)
+
+        if self.decode_ar and self.speculative:
+            logits = self._decode_speculative(tokenizer, memory, memory_kv, num_steps, testing)
+        elif self.decode_ar:
+            logits = self._decode_ar(tokenizer, memory, memory_kv, num_steps, testing)
+        else:
+            logits = self._decode_nar(tokenizer, memory, memory_kv, num_steps)
+
+        if self.refine_iters:
+            logits = self._refine(tokenizer, logits, memory, memory_kv, num_steps)
 
         return logits
@@ -24,14 +24,104 @@ from torch.nn.modules import transformer
 from timm.models.vision_transformer import PatchEmbed, VisionTransformer
 
 
+def _split_heads(x: Tensor, num_heads: int) -> Tensor:
+    """N, L, E -> N * num_heads, L, head_dim (same layout as nn.MultiheadAttention)"""
+    N, L, E = x.shape
+    return x.view(N, L, num_heads, E // num_heads).transpose(1, 2).reshape(N * num_heads, L, E // num_heads)
+
+
+class Attention(nn.Module):
+    """Multi-head attention on top of F.scaled_dot_product_attention (fused kernels).
+
+    The input projections are nn.Linear layers (so that they can be quantized), one for the queries and a fused one for
+    the keys and values. Checkpoints with the nn.MultiheadAttention parameters (in_proj_weight, in_proj_bias) can still
+    be loaded. The keys and values can be projected separately (see project_kv()) and reused, e.g. across the two
+    streams, decoding steps, or as a cache.
+    Attention weights (averaged over the heads) are only computed if requested, since the fused kernels don't
+    return them.
+    """
+
+    def __init__(self, embed_dim: int, num_heads: int, dropout: float = 0.0):
+        super().__init__()
+        self.embed_dim = embed_dim
+        self.num_heads = num_heads
+        self.head_dim = embed_dim // num_heads
+        self.dropout = dropout
+        self.q_proj = nn.Linear(embed_dim, embed_dim)
+        self.kv_proj = nn.Linear(embed_dim, 2 * embed_dim)
+        self.out_proj = nn.Linear(embed_dim, embed_dim)
+        # Same as nn.MultiheadAttention, i.e. as a single (3 * embed_dim, embed_dim) input projection
+        with torch.no_grad():
+            in_proj_weight = nn.init.xavier_uniform_(torch.empty(3 * embed_dim, embed_dim))
+            self.q_proj.weight.copy_(in_proj_weight[:embed_dim])
+            self.kv_proj.weight.copy_(in_proj_weight[embed_dim:])
+        nn.init.zeros_(self.q_proj.bias)
+        nn.init.zeros_(self.kv_proj.bias)
+        nn.init.zeros_(self.out_proj.bias)
+
+    def _load_from_state_dict(self, state_dict, prefix, *args, **kwargs):
+        # nn.MultiheadAttention format: a single input projection for the queries, keys and values.
+        for name in ('weight', 'bias'):
+            in_proj = state_dict.pop(f'{prefix}in_proj_{name}', None)
+            if in_proj is not None:
+                state_dict[f'{prefix}q_proj.{name}'] = in_proj[: self.embed_dim]
+                state_dict[f'{prefix}kv_proj.{name}'] = in_proj[self.embed_dim :]
+        super()._load_from_state_dict(state_dict, prefix, *args, **kwargs)
+
+    def project_kv(self, x: Tensor) -> tuple[Tensor, Tensor]:
+        """Keys and values of `x`, with a single (fused) projection. Shape: N * num_heads, L, head_dim"""
+        k, v = self.kv_proj(x).chunk(2, dim=-1)
+        return _split_heads(k, self.num_heads), _split_heads(v, self.num_heads)
+
+    def forward(
+        self,
+        query: Tensor,
+        key_value: Optional[Tensor] = None,
+        attn_mask: Optional[Tensor] = None,
+        key_padding_mask: Optional[Tensor] = None,
+        kv: Optional[tuple[Tensor, Tensor]] = None,
+        need_weights: bool = False,
+    ) -> tuple[Tensor, Optional[Tensor]]:
+        """Attention of `query` (N, L, E) to `key_value` (N, S, E), or to the precomputed keys and values `kv`.
+
+        The masks follow the nn.MultiheadAttention convention (True = not allowed to attend): attn_mask is either
+        (L, S), (N * num_heads, L, S), or (N, 1 or num_heads, L, S), and key_padding_mask is (N, S).
+        """
+        N, L, E = query.shape
+        H = self.num_heads
+        q = self.q_proj(query).view(N, L, H, -1).transpose(1, 2)
+        if kv is None:
+            kv = self.project_kv(key_value)
+        k, v = (t.unflatten(0, (N, H)) for t in kv)
+        mask = None
+        if attn_mask is not None:
+            mask = attn_mask.view(N, H, L, -1) if attn_mask.dim() == 3 else attn_mask
+        if key_padding_mask is not None:
+            padding_mask = key_padding_mask.view(N, 1, 1, -1)
+            mask = padding_mask if mask is None else mask | padding_mask
+        dropout = self.dropout if self.training else 0.0
+        if need_weights:
+            scores = torch.matmul(q, k.transpose(-2, -1)) * math.sqrt(1.0 / q.shape[-1])
+            if mask is not None:
+                scores = scores.masked_fill(mask, float('-inf'))
+            weights = scores.softmax(dim=-1)
+            out = torch.matmul(F.dropout(weights, dropout, self.training), v)
+            weights = weights.mean(dim=1)
+        else:
+            # F.scaled_dot_product_attention expects True = allowed to attend.
+            out = F.scaled_dot_product_attention(q, k, v, None if mask is None else ~mask, dropout)
+            weights = None
+        return self.out_proj(out.transpose(1, 2).reshape(N, L, E)), weights
+
+
 class DecoderLayer(nn.Module):
     """A Transformer decoder layer supporting two-stream attention (XLNet)
     This implements a pre-LN decoder, as opposed to the post-LN default in PyTorch."""
 
     def __init__(self, d_model, nhead, dim_feedforward=2048, dropout=0.1, activation='gelu', layer_norm_eps=1e-5):
         super().__init__()
-        self.self_attn = nn.MultiheadAttention(d_model, nhead, dropout=dropout, batch_first=True)
-        self.cross_attn = nn.MultiheadAttention(d_model, nhead, dropout=dropout, batch_first=True)
+        self.self_attn = Attention(d_model, nhead, dropout=dropout)
+        self.cross_attn = Attention(d_model, nhead, dropout=dropout)
         # Implementation of Feedforward model
         self.linear1 = nn.Linear(d_model, dim_feedforward)
         self.dropout = nn.Dropout(dropout)
@@ -56,27 +146,63 @@ class DecoderLayer(nn.Module):
         self,
         tgt: Tensor,
         tgt_norm: Tensor,
-        tgt_kv: Tensor,
+        tgt_kv: tuple[Tensor, Tensor],
         memory: Tensor,
         tgt_mask: Optional[Tensor],
         tgt_key_padding_mask: Optional[Tensor],
+        memory_kv: Optional[tuple[Tensor, Tensor]] = None,
+        need_weights: bool = False,
     ):
         """Forward pass for a single stream (i.e. content or query)
         tgt_norm is just a LayerNorm'd tgt. Added as a separate parameter for efficiency.
-        Both tgt_kv and memory are expected to be LayerNorm'd too.
+        tgt_kv are the self-attention keys and values of the LayerNorm'd content (see Attention.project_kv()),
+        shared by both streams.
         memory is LayerNorm'd by ViT.
+        memory_kv are the cross-attention keys and values of memory (see project_memory()), if precomputed.
+        The attention weights are only computed if need_weights is set, otherwise None is returned.
         """
         tgt2, sa_weights = self.self_attn(
-            tgt_norm, tgt_kv, tgt_kv, attn_mask=tgt_mask, key_padding_mask=tgt_key_padding_mask
+            tgt_norm,
+            attn_mask=tgt_mask,
+            key_padding_mask=tgt_key_padding_mask,
+            kv=tgt_kv,
+            need_weights=need_weights,
         )
         tgt = tgt + self.dropout1(tgt2)
+        tgt, ca_weights = self._forward_ca_ff(tgt, memory, memory_kv, need_weights)
+        return tgt, sa_weights, ca_weights
 
-        tgt2, ca_weights = self.cross_attn(self.norm1(tgt), memory, memory)
+    def _forward_ca_ff(
+        self,
+        tgt: Tensor,
+        memory: Tensor,
+        memory_kv: Optional[tuple[Tensor, Tensor]],
+        need_weights: bool = False,
+    ):
+        """Cross-attention and feedforward blocks"""
+        tgt2, ca_weights = self.cross_attn(self.norm1(tgt), memory, kv=memory_kv, need_weights=need_weights)
         tgt = tgt + self.dropout2(tgt2)
 
         tgt2 = self.linear2(self.dropout(self.activation(self.linear1(self.norm2(tgt)))))
         tgt = tgt + self.dropout3(tgt2)
-        return tgt, sa_weights, ca_weights
+        return tgt, ca_weights
+
+    def project_memory(self, memory: Tensor) -> tuple[Tensor, Tensor]:
+        """Cross-attention keys and values of memory. These are constant for all decoding steps."""
+        return self.cross_attn.project_kv(memory)
+
+    def forward_stream_cached(
+        self,
+        tgt: Tensor,
+        tgt_norm: Tensor,
+        k: Tensor,
+        v: Tensor,
+        memory: Tensor,
+        memory_kv: Optional[tuple[Tensor, Tensor]] = None,
+    ):
+        """Like forward_stream(), but tgt attends to all the given (cached) self-attention keys and values."""
+        tgt = tgt + self.dropout1(self.self_attn(tgt_norm, kv=(k, v))[0])
+        return self._forward_ca_ff(tgt, memory, memory_kv)[0]
 
     def forward(
         self,
@@ -87,14 +213,48 @@ class DecoderLayer(nn.Module):
         content_mask: Optional[Tensor] = None,
         content_key_padding_mask: Optional[Tensor] = None,
         update_content: bool = True,
+        memory_kv: Optional[tuple[Tensor, Tensor]] = None,
+        need_weights: bool = False,
     ):
+        """If need_weights is set, the cross-attention weights of the query stream are returned as well."""
         query_norm = self.norm_q(query)
         content_norm = self.norm_c(content)
-        query = self.forward_stream(query, query_norm, content_norm, memory, query_mask, content_key_padding_mask)[0]
+        # The keys and values of the content are the same for both streams.
+        content_kv = self.self_attn.project_kv(content_norm)
+        query, _, ca_weights = self.forward_stream(
+            query, query_norm, content_kv, memory, query_mask, content_key_padding_mask, memory_kv, need_weights
+        )
         if update_content:
             content = self.forward_stream(
-                content, content_norm, content_norm, memory, content_mask, content_key_padding_mask
+                content, content_norm, content_kv, memory, content_mask, content_key_padding_mask, memory_kv
             )[0]
+        if need_weights:
+            return query, content, ca_weights
+        return query, content
+
+    def forward_cached(
+        self,
+        query: Tensor,
+        content: Tensor,
+        memory: Tensor,
+        cache: tuple[Tensor, Tensor],
+        pos: int,
+        update_content: bool = True,
+        memory_kv: Optional[tuple[Tensor, Tensor]] = None,
+    ):
+        """Incremental decoding step for the canonical (left-to-right) AR context.
+
+        `content` is the new token at position `pos` only. Its keys and values are written to `cache` (preallocated
+        buffers of shape N * num_heads, max length, head_dim) so that the previous positions aren't recomputed.
+        Both streams attend to all the cached positions up to `pos`.
+        """
+        content_norm = self.norm_c(content)
+        k_cache, v_cache = cache
+        k_cache[:, pos : pos + 1], v_cache[:, pos : pos + 1] = self.self_attn.project_kv(content_norm)
+        k, v = k_cache[:, : pos + 1], v_cache[:, : pos + 1]
+        query = self.forward_stream_cached(query, self.norm_q(query), k, v, memory, memory_kv)
+        if update_content:
+            content = self.forward_stream_cached(content, content_norm, k, v, memory, memory_kv)
         return query, content
 
 
@@ -115,11 +275,68 @@ class Decoder(nn.Module):
         query_mask: Optional[Tensor] = None,
         content_mask: Optional[Tensor] = None,
         content_key_padding_mask: Optional[Tensor] = None,
+        memory_kv: Optional[list[tuple[Tensor, Tensor]]] = None,
+        need_weights: bool = False,
+    ):
+        """If need_weights is set, the cross-attention weights of the query stream (averaged over the heads) are
+        returned as well, for each layer. Shape: num_layers, N, L, S"""
+        if memory_kv is None:
+            memory_kv = [None] * len(self.layers)
+        ca_weights = []
+        for i, (mod, layer_memory_kv) in enumerate(zip(self.layers, memory_kv)):
+            last = i == len(self.layers) - 1
+            query, content, *weights = mod(
+                query,
+                content,
+                memory,
+                query_mask,
+                content_mask,
+                content_key_padding_mask,
+                update_content=not last,
+                memory_kv=layer_memory_kv,
+                need_weights=need_weights,
+            )
+            ca_weights += weights
+        query = self.norm(query)
+        if need_weights:
+            return query, torch.stack(ca_weights)
+        return query
+
+    def project_memory(self, memory: Tensor) -> list[tuple[Tensor, Tensor]]:
+        """Cross-attention keys and values of memory for each layer, to be reused across decode() calls."""
+        return [mod.project_memory(memory) for mod in self.layers]
+
+    def init_cache(self, batch_size: int, max_length: int, device: torch.device, dtype: torch.dtype):
+        """Key/value buffers of each layer, for forward_cached()"""
+        cache = []
+        for mod in self.layers:
+            shape = (batch_size * mod.self_attn.num_heads, max_length, mod.self_attn.head_dim)
+            k = torch.empty(shape, device=device, dtype=dtype)
+            v = torch.empty(shape, device=device, dtype=dtype)
+            cache.append((k, v))
+        return cache
+
+    @staticmethod
+    def select_kv(kv: list[tuple[Tensor, Tensor]], index: Tensor, batch_size: int) -> list[tuple[Tensor, Tensor]]:
+        """Select the samples `index` from per-layer keys and values (N * num_heads, L, head_dim)"""
+        return [tuple(t.unflatten(0, (batch_size, -1))[index].flatten(0, 1) for t in layer_kv) for layer_kv in kv]
+
+    def forward_cached(
+        self,
+        query: Tensor,
+        content: Tensor,
+        memory: Tensor,
+        cache: list,
+        pos: int,
+        memory_kv: Optional[list[tuple[Tensor, Tensor]]] = None,
     ):
-        for i, mod in enumerate(self.layers):
+        """Incremental version of forward() for the canonical AR context. See DecoderLayer.forward_cached()."""
+        if memory_kv is None:
+            memory_kv = [None] * len(self.layers)
+        for i, (mod, layer_cache, layer_memory_kv) in enumerate(zip(self.layers, cache, memory_kv)):
             last = i == len(self.layers) - 1
-            query, content = mod(
-                query, content, memory, query_mask, content_mask, content_key_padding_mask, update_content=not last
+            query, content = mod.forward_cached(
+                query, content, memory, layer_cache, pos, update_content=not last, memory_kv=layer_memory_kv
             )
         query = self.norm(query)
         return query
@@ -56,6 +56,10 @@ class PARSeq(CrossEntropySystem):
         decode_ar: bool,
         refine_iters: int,
         dropout: float,
+        kv_cache: bool = True,
+        cascade_threshold: Optional[float] = None,
+        speculative: bool = False,
+        perm_batched: bool = False,
         **kwargs: Any,
     ) -> None:
         super().__init__(charset_train, charset_test, batch_size, lr, warmup_pct, weight_decay)
@@ -76,6 +80,9 @@ class PARSeq(CrossEntropySystem):
             decode_ar,
             refine_iters,
             dropout,
+            kv_cache,
+            cascade_threshold,
+            speculative,
         )
 
         # Perm/attn mask stuff
@@ -83,8 +90,19 @@ class PARSeq(CrossEntropySystem):
         self.max_gen_perms = perm_num // 2 if perm_mirrored else perm_num
         self.perm_forward = perm_forward
         self.perm_mirrored = perm_mirrored
+        self.perm_batched = perm_batched
+        # Pools of permutations of short sequences, keyed by (number of chars, device)
+        self._perm_pools: dict[tuple[int, torch.device], Tensor] = {}
+        # Attention masks of the canonical (forward and reverse) orderings, keyed by (sequence length, device)
+        self._canonical_masks: dict[tuple[int, torch.device], tuple[Tensor, Tensor]] = {}
 
     def forward(self, images: Tensor, max_length: Optional[int] = None) -> Tensor:
+        if self.static_shapes:
+            if self.model.cascade_threshold is not None or self.model.speculative:
+                raise ValueError('cascade_threshold and speculative are not supported with static shapes')
+            if max_length is None:
+                # Always decode up to the max. length, i.e. no early exit.
+                max_length = self.model.max_label_length
         return self.model.forward(self.tokenizer, images, max_length)
 
     def gen_tgt_perms(self, tgt):
@@ -106,28 +124,15 @@ class PARSeq(CrossEntropySystem):
         # For 4-char sequences and shorter, we generate all permutations and sample from the pool to avoid collisions
         # Note that this code path might NEVER get executed since the labels in a mini-batch typically exceed 4 chars.
         if max_num_chars < 5:
-            # Pool of permutations to sample from. We only need the first half (if complementary option is selected)
-            # Special handling for max_num_chars == 4 which correctly divides the pool into the flipped halves
-            if max_num_chars == 4 and self.perm_mirrored:
-                selector = [0, 3, 4, 6, 9, 10, 12, 16, 17, 18, 19, 21]
-            else:
-                selector = list(range(max_perms))
-            perm_pool = torch.as_tensor(
-                list(permutations(range(max_num_chars), max_num_chars)),
-                device=self._device,
-            )[selector]
-            # If the forward permutation is always selected, no need to add it to the pool for sampling
-            if self.perm_forward:
-                perm_pool = perm_pool[1:]
+            perm_pool = self._perm_pool(max_num_chars, max_perms)
             perms = torch.stack(perms)
             if len(perm_pool):
                 i = self.rng.choice(len(perm_pool), size=num_gen_perms - len(perms), replace=False)
                 perms = torch.cat([perms, perm_pool[i]])
         else:
-            perms.extend(
-                [torch.randperm(max_num_chars, device=self._device) for _ in range(num_gen_perms - len(perms))]
-            )
-            perms = torch.stack(perms)
+            # Random permutations, all at once
+            rand_perms = torch.rand((num_gen_perms - len(perms), max_num_chars), device=self._device).argsort(-1)
+            perms = torch.cat([torch.stack(perms), rand_perms]) if perms else rand_perms
         if self.perm_mirrored:
             # Add complementary pairs
             comp = perms.flip(-1)
@@ -150,20 +155,58 @@ class PARSeq(CrossEntropySystem):
             perms[1, 1:] = max_num_chars + 1 - torch.arange(max_num_chars + 1, device=self._device)
         return perms
 
+    def _perm_pool(self, max_num_chars: int, max_perms: int) -> Tensor:
+        """Pool of permutations to sample from, for short sequences. Built once per sequence length and device."""
+        key = (max_num_chars, self._device)
+        if key not in self._perm_pools:
+            # We only need the first half (if complementary option is selected)
+            # Special handling for max_num_chars == 4 which correctly divides the pool into the flipped halves
+            if max_num_chars == 4 and self.perm_mirrored:
+                selector = [0, 3, 4, 6, 9, 10, 12, 16, 17, 18, 19, 21]
+            else:
+                selector = list(range(max_perms))
+            perm_pool = torch.as_tensor(
+                list(permutations(range(max_num_chars), max_num_chars)),
+                device=self._device,
+            )[selector]
+            # If the forward permutation is always selected, no need to add it to the pool for sampling
+            if self.perm_forward:
+                perm_pool = perm_pool[1:]
+            self._perm_pools[key] = perm_pool
+        return self._perm_pools[key]
+
     def generate_attn_masks(self, perm):
         """Generate attention masks given a sequence permutation (includes pos. for bos and eos tokens)
-        :param perm: the permutation sequence. i = 0 is always the BOS
+        :param perm: the permutation sequence. i = 0 is always the BOS. Can also be a batch of permutations (P, sz).
         :return: lookahead attention masks
         """
-        sz = perm.shape[0]
-        mask = torch.zeros((sz, sz), dtype=torch.bool, device=self._device)
-        for i in range(sz):
-            query_idx = perm[i]
-            masked_keys = perm[i + 1 :]
-            mask[query_idx, masked_keys] = True
-        content_mask = mask[:-1, :-1].clone()
-        mask[torch.eye(sz, dtype=torch.bool, device=self._device)] = True  # mask "self"
-        query_mask = mask[1:, :-1]
+        sz = perm.shape[-1]
+        # Position of each token in the permutation order
+        order = torch.arange(sz, device=perm.device).expand_as(perm)
+        rank = torch.empty_like(perm).scatter_(-1, perm, order)
+        # Each query can't attend to the keys which come after it in the permutation order.
+        mask = rank.unsqueeze(-2) > rank.unsqueeze(-1)
+        content_mask = mask[..., :-1, :-1]
+        mask = mask | torch.eye(sz, dtype=torch.bool, device=perm.device)  # mask "self"
+        query_mask = mask[..., 1:, :-1]
+        return content_mask, query_mask
+
+    def _perm_attn_masks(self, perms: Tensor) -> tuple[Tensor, Tensor]:
+        """Same as generate_attn_masks(perms), but the masks of the canonical orderings are only built once."""
+        if not self.perm_forward or len(perms) < 2:
+            return self.generate_attn_masks(perms)
+        # The first two permutations are the forward and reverse orderings (see gen_tgt_perms()).
+        sz = perms.shape[1]
+        key = (sz, perms.device)
+        if key not in self._canonical_masks:
+            fwd = torch.arange(sz, device=perms.device)
+            rev = torch.cat([fwd[:1], sz - fwd[1:]])
+            self._canonical_masks[key] = self.generate_attn_masks(torch.stack([fwd, rev]))
+        content_mask, query_mask = self._canonical_masks[key]
+        if len(perms) > 2:
+            content_masks, query_masks = self.generate_attn_masks(perms[2:])
+            content_mask = torch.cat([content_mask, content_masks])
+            query_mask = torch.cat([query_mask, query_masks])
         return content_mask, query_mask
 
     def training_step(self, batch, batch_idx) -> STEP_OUTPUT:
@@ -180,11 +223,17 @@ class PARSeq(CrossEntropySystem):
         # The [EOS] token is not depended upon by any other token in any permutation ordering
         tgt_padding_mask = (tgt_in == self.pad_id) | (tgt_in == self.eos_id)
 
+        if self.perm_batched:
+            loss = self._batched_perm_loss(memory, tgt_perms, tgt_in, tgt_out, tgt_padding_mask)
+            self.log('loss', loss)
+            return loss
+
         loss = 0
         loss_numel = 0
         n = (tgt_out != self.pad_id).sum().item()
-        for i, perm in enumerate(tgt_perms):
-            tgt_mask, query_mask = self.generate_attn_masks(perm)
+        # The masks of all the permutations at once
+        tgt_masks, query_masks = self._perm_attn_masks(tgt_perms)
+        for i, (tgt_mask, query_mask) in enumerate(zip(tgt_masks, query_masks)):
             out = self.model.decode(tgt_in, memory, tgt_mask, tgt_padding_mask, tgt_query_mask=query_mask)
             logits = self.model.head(out).flatten(end_dim=1)
             loss += n * F.cross_entropy(logits, tgt_out.flatten(), ignore_index=self.pad_id)
@@ -198,3 +247,30 @@ class PARSeq(CrossEntropySystem):
 
         self.log('loss', loss)
         return loss
+
+    def _batched_perm_loss(
+        self, memory: Tensor, tgt_perms: Tensor, tgt_in: Tensor, tgt_out: Tensor, tgt_padding_mask: Tensor
+    ) -> Tensor:
+        """Same loss as the loop over the permutations in training_step(), but with a single decoder call.
+
+        The permutations are stacked along the batch dimension (permutation-major). Each one has its own attention
+        masks, which are expanded to per-sample masks (broadcast over the heads).
+        """
+        num_perms = len(tgt_perms)
+        bs = tgt_in.shape[0]
+        tgt_mask, query_mask = self._perm_attn_masks(tgt_perms)
+        tgt_mask = tgt_mask.repeat_interleave(bs, dim=0).unsqueeze(1)
+        query_mask = query_mask.repeat_interleave(bs, dim=0).unsqueeze(1)
+        out = self.model.decode(
+            tgt_in.repeat(num_perms, 1),
+            memory.repeat(num_perms, 1, 1),
+            tgt_mask,
+            tgt_padding_mask.repeat(num_perms, 1),
+            tgt_query_mask=query_mask,
+        )
+        logits = self.model.head(out).flatten(end_dim=1)
+        # The [EOS] tokens are only used for the first two permutations (canonical and reverse orderings).
+        tgt_out = tgt_out.repeat(num_perms, 1)
+        tgt_out[2 * bs :] = torch.where(tgt_out[2 * bs :] == self.eos_id, self.pad_id, tgt_out[2 * bs :])
+        # Averaging over all the (non-padding) targets at once is the same as the weighted average of the loop.
+        return F.cross_entropy(logits, tgt_out.flatten(), ignore_index=self.pad_id)
@@ -19,7 +19,6 @@ class TRBA(nn.Module):
         """ FeatureExtraction """
         self.FeatureExtraction = ResNet_FeatureExtractor(input_channel, output_channel)
         self.FeatureExtraction_output = output_channel
-        self.AdaptiveAvgPool = nn.AdaptiveAvgPool2d((None, 1))  # Transform final (imgH/16-1) -> 1
 
         """ Sequence modeling"""
         self.SequenceModeling = nn.Sequential(
@@ -33,22 +32,22 @@ class TRBA(nn.Module):
         else:
             self.Prediction = Attention(self.SequenceModeling_output, hidden_size, num_class)
 
-    def forward(self, image, max_label_length, text=None):
+    def forward(self, image, max_label_length, text=None, eos_id=None):
         """ Transformation stage """
         image = self.Transformation(image)
 
         """ Feature extraction stage """
         visual_feature = self.FeatureExtraction(image)
         visual_feature = visual_feature.permute(0, 3, 1, 2)  # [b, c, h, w] -> [b, w, c, h]
-        visual_feature = self.AdaptiveAvgPool(visual_feature)  # [b, w, c, h] -> [b, w, c, 1]
-        visual_feature = visual_feature.squeeze(3)  # [b, w, c, 1] -> [b, w, c]
+        # Average over the final (imgH/16-1) rows, i.e. AdaptiveAvgPool2d((None, 1)) + squeeze (exportable to ONNX)
+        visual_feature = visual_feature.mean(dim=3)  # [b, w, c, h] -> [b, w, c]
 
         """ Sequence modeling stage """
         contextual_feature = self.SequenceModeling(visual_feature)  # [b, num_steps, hidden_size]
 
         """ Prediction stage """
         if isinstance(self.Prediction, Attention):
-            prediction = self.Prediction(contextual_feature.contiguous(), text, max_label_length)
+            prediction = self.Prediction(contextual_feature.contiguous(), text, max_label_length, eos_id)
         else:
             prediction = self.Prediction(contextual_feature.contiguous())  # CTC
 
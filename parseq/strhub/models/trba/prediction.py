@@ -13,11 +13,14 @@ class Attention(nn.Module):
         self.generator = nn.Linear(hidden_size, num_class)
         self.char_embeddings = nn.Embedding(num_class, num_char_embeddings)
 
-    def forward(self, batch_H, text, max_label_length=25):
+    def forward(self, batch_H, text, max_label_length=25, eos_id=None):
         """
         input:
             batch_H : contextual_feature H = hidden state of encoder. [batch_size x num_steps x num_class]
             text : the text-index of each image. [batch_size x (max_length+1)]. +1 for [SOS] token. text[:, 0] = [SOS].
+            eos_id : (eval only) if set, sequences are removed from the batch once they output [EOS], and decoding
+                stops once all of them have. The remaining steps of finished sequences only predict [EOS] (their
+                logits are 0 for [EOS] and the lowest float for the other classes).
         output: probability distribution at each step [batch_size x num_steps x num_class]
         """
         batch_size = batch_H.size(0)
@@ -37,15 +40,35 @@ class Attention(nn.Module):
 
         else:
             targets = text[0].expand(batch_size)  # should be fill with [SOS] token
-            probs = batch_H.new_zeros((batch_size, num_steps, self.num_class), dtype=torch.float)
+            if eos_id is None:
+                probs = batch_H.new_zeros((batch_size, num_steps, self.num_class), dtype=torch.float)
+            else:
+                probs = batch_H.new_full((batch_size, num_steps, self.num_class), torch.finfo(torch.float).min)
+                probs[..., eos_id] = 0
+            # Indices (in the full batch) of the sequences which are still being decoded
+            active = torch.arange(batch_size, device=batch_H.device)
 
             for i in range(num_steps):
                 char_embeddings = self.char_embeddings(targets)
                 hidden, alpha = self.attention_cell(hidden, batch_H, char_embeddings)
                 probs_step = self.generator(hidden[0])
-                probs[:, i, :] = probs_step
+                if eos_id is None:
+                    probs[:, i, :] = probs_step
+                else:
+                    probs[active, i, :] = probs_step
                 _, next_input = probs_step.max(1)
                 targets = next_input
+                if eos_id is not None:
+                    # Batch compaction: remove the finished sequences
+                    keep = (next_input != eos_id).nonzero().squeeze(1)
+                    if not len(keep):
+                        probs = probs[:, : i + 1]
+                        break
+                    if len(keep) < len(active):
+                        active = active[keep]
+                        targets = targets[keep]
+                        batch_H = batch_H[keep]
+                        hidden = (hidden[0][keep], hidden[1][keep])
 
         return probs  # batch_size x num_steps x num_class
 
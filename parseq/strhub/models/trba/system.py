@@ -30,6 +30,8 @@ from .model import TRBA as Model
 
 
 class TRBA(CrossEntropySystem):
+    # The fully-connected layers of the localization network, which regress the fiducial points, are kept in fp32.
+    quantizable_modules = ('model.Transformation.LocalizationNetwork.conv', 'model.FeatureExtraction')
 
     def __init__(
         self,
@@ -66,9 +68,11 @@ class TRBA(CrossEntropySystem):
         return {'model.Prediction.char_embeddings.weight'}
 
     def forward(self, images: Tensor, max_length: Optional[int] = None) -> Tensor:
+        # Like PARSeq, decoding stops early (per sample) only when max_length isn't specified, i.e. at test-time.
+        eos_id = self.eos_id if max_length is None and not self.static_shapes else None
         max_length = self.max_label_length if max_length is None else min(max_length, self.max_label_length)
         text = images.new_full([1], self.bos_id, dtype=torch.long)
-        return self.model.forward(images, max_length, text)
+        return self.model.forward(images, max_length, text, eos_id)
 
     def training_step(self, batch, batch_idx) -> STEP_OUTPUT:
         images, labels = batch
@@ -83,6 +87,7 @@ class TRBA(CrossEntropySystem):
 
 
 class TRBC(CTCSystem):
+    quantizable_modules = TRBA.quantizable_modules
 
     def __init__(
         self,
@@ -1,10 +1,11 @@
+from functools import partial
 from pathlib import PurePath
-from typing import Sequence
+from typing import Iterable, Optional, Sequence
 
 import yaml
 
 import torch
-from torch import nn
+from torch import Tensor, nn
 
 
 class InvalidModelError(RuntimeError):
@@ -70,7 +71,9 @@ def get_pretrained_weights(experiment):
     return torch.hub.load_state_dict_from_url(url=url, map_location='cpu', check_hash=True)
 
 
-def create_model(experiment: str, pretrained: bool = False, **kwargs):
+def create_model(
+    experiment: str, pretrained: bool = False, compile: bool = False, quantize: Optional[str] = None, **kwargs
+):
     try:
         config = _get_config(experiment, **kwargs)
     except FileNotFoundError:
@@ -80,19 +83,128 @@ def create_model(experiment: str, pretrained: bool = False, **kwargs):
     if pretrained:
         m = model.model if 'parseq' in experiment else model
         m.load_state_dict(get_pretrained_weights(experiment))
+    if quantize is not None:
+        model = quantize_model(model, quantize)
+    if compile:
+        model = compile_model(model)
     return model
 
 
-def load_from_checkpoint(checkpoint_path: str, **kwargs):
+def load_from_checkpoint(
+    checkpoint_path: str,
+    compile: bool = False,
+    quantize: Optional[str] = None,
+    quantized_weights: Optional[str] = None,
+    **kwargs,
+):
+    """For quantize='static', `quantized_weights` is the state_dict saved by tools/quantize_static.py."""
     if checkpoint_path.startswith('pretrained='):
         model_id = checkpoint_path.split('=', maxsplit=1)[1]
         model = create_model(model_id, True, **kwargs)
     else:
         ModelClass = _get_model_class(checkpoint_path)
         model = ModelClass.load_from_checkpoint(checkpoint_path, **kwargs)
+    if quantize == 'static':
+        if quantized_weights is None:
+            raise InvalidModelError('Static quantization requires the quantized weights (see tools/quantize_static.py)')
+        model = quantize_static(model)
+        model.load_state_dict(torch.load(quantized_weights, map_location='cpu'))
+    elif quantize is not None:
+        model = quantize_model(model, quantize)
+    if compile:
+        model = compile_model(model)
     return model
 
 
+def compile_model(model, **compile_kwargs):
+    """Enable static shapes for inference (see BaseSystem.static_shapes), then compile forward() with torch.compile.
+
+    Compilation happens lazily, on the first call for each input shape. Use warmup() to trigger it ahead of time.
+    """
+    model.static_shapes = True
+    model.forward = torch.compile(model.forward, **compile_kwargs)
+    return model
+
+
+# Layers kept in fp32 by quantize_model(): the classifiers, and the ABINet language model input projection (which
+# plays the role of a token embedding). Embeddings and LayerNorms aren't quantized by dynamic quantization anyway.
+QUANTIZE_EXCLUDE = ('head', 'cls', 'generator', 'Prediction', 'language.proj')
+
+
+def quantize_model(model, mode: str = 'dynamic', exclude: Sequence[str] = QUANTIZE_EXCLUDE):
+    """Quantize the nn.Linear layers of `model` to int8 for CPU inference. The quantized model runs on the CPU only.
+
+    Only dynamic quantization (int8 weights, activations quantized on the fly) is supported, which targets the
+    transformer-based models (PARSeq, ViTSTR, ABINet). Layers whose (qualified) name ends with any of `exclude` are
+    kept in fp32. Note that the Q/K/V input projection of nn.MultiheadAttention (ABINet) isn't an nn.Linear layer, so
+    it stays in fp32 as well (unlike the ones of the PARSeq decoder).
+    """
+    if mode != 'dynamic':
+        raise InvalidModelError(f"Unsupported quantization mode: '{mode}' (see quantize_static() for static)")
+    # Exact type: excludes the NonDynamicallyQuantizableLinear output projection of nn.MultiheadAttention.
+    names = {
+        name
+        for name, m in model.named_modules()
+        if type(m) is nn.Linear and not any(name == e or name.endswith('.' + e) for e in exclude)
+    }
+    return torch.ao.quantization.quantize_dynamic(model.eval().cpu(), names, dtype=torch.qint8)
+
+
+def _set_submodule(model: nn.Module, name: str, module: nn.Module) -> None:
+    parent, _, child = name.rpartition('.')
+    setattr(model.get_submodule(parent), child, module)
+
+
+def quantize_static(model, calibration_data: Optional[Iterable[Tensor]] = None, backend: str = 'x86'):
+    """Static int8 quantization (FX graph mode) of the convolutional feature extractors of `model`, for CPU inference.
+
+    The modules listed in BaseSystem.quantizable_modules are traced, Conv-BN(-ReLU) are fused, and the activation
+    ranges are calibrated by running `model` on `calibration_data` (batches of normalized images). The rest of the
+    model is kept in fp32. Without calibration data, the quantized modules are only placeholders, e.g. for loading
+    the state_dict of a calibrated model. `model` is modified in place.
+    """
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+
+    names = model.quantizable_modules
+    if not names:
+        raise InvalidModelError(f'{type(model).__name__} has no modules to quantize statically')
+    torch.backends.quantized.engine = backend
+    model = model.eval().cpu()
+    # The inputs of the modules, as example inputs for tracing.
+    example_inputs = {}
+
+    def capture(name, module, args):
+        example_inputs.setdefault(name, args)
+
+    hooks = [model.get_submodule(name).register_forward_pre_hook(partial(capture, name)) for name in names]
+    h, w = model.hparams.img_size
+    with torch.no_grad():
+        model(torch.rand(1, 3, h, w))
+    for hook in hooks:
+        hook.remove()
+    qconfig_mapping = get_default_qconfig_mapping(backend)
+    for name in names:
+        _set_submodule(model, name, prepare_fx(model.get_submodule(name), qconfig_mapping, example_inputs[name]))
+    if calibration_data is not None:
+        with torch.no_grad():
+            for images in calibration_data:
+                model(images)
+    for name in names:
+        _set_submodule(model, name, convert_fx(model.get_submodule(name)))
+    return model
+
+
+@torch.inference_mode()
+def warmup(model, batch_sizes: Sequence[int] = (1,), iters: int = 2) -> None:
+    """Run the model on random images of each batch size, e.g. to compile it (see compile_model()) before use."""
+    h, w = model.hparams.img_size
+    for batch_size in batch_sizes:
+        images = torch.rand(batch_size, 3, h, w, device=model.device)
+        for _ in range(iters):
+            model(images)
+
+
 def parse_model_args(args):
     kwargs = {}
     arg_types = {t.__name__: t for t in [int, float, str]}
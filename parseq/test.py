@@ -15,8 +15,10 @@
 # limitations under the License.
 
 import argparse
+import io
 import string
 import sys
+import time
 from dataclasses import dataclass
 
 from tqdm import tqdm
@@ -24,6 +26,7 @@ from tqdm import tqdm
 import torch
 
 from strhub.data.module import SceneTextDataModule
+from strhub.models.export import use_onnx_runtime
 from strhub.models.utils import load_from_checkpoint, parse_model_args
 
 
@@ -66,6 +69,73 @@ def print_results_table(results: list[Result], file=None):
     )
 
 
+def state_dict_size(model) -> int:
+    """Size in bytes of the serialized state_dict"""
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.tell()
+
+
+def evaluate(model, datamodule: SceneTextDataModule, test_set: list[str]) -> tuple[dict[str, Result], float]:
+    """Returns the results per dataset, and the mean time (in ms) per image spent in the model."""
+    results = {}
+    elapsed = 0.0
+    max_width = max(map(len, test_set))
+    for name, dataloader in datamodule.test_dataloaders(test_set).items():
+        total = 0
+        correct = 0
+        ned = 0
+        confidence = 0
+        label_length = 0
+        for imgs, labels in tqdm(iter(dataloader), desc=f'{name:>{max_width}}'):
+            start = time.perf_counter()
+            # Normalize on the device. The workers only output uint8 images.
+            imgs = SceneTextDataModule.normalize(imgs.to(model.device, non_blocking=True))
+            res = model.test_step((imgs, labels), -1)['output']
+            elapsed += time.perf_counter() - start
+            total += res.num_samples
+            correct += res.correct
+            ned += res.ned
+            confidence += res.confidence
+            label_length += res.label_length
+        # The results are tensors on the device. Sync only once per dataset.
+        correct, ned, confidence, label_length = map(float, (correct, ned, confidence, label_length))
+        accuracy = 100 * correct / total
+        mean_ned = 100 * (1 - ned / total)
+        mean_conf = 100 * confidence / total
+        mean_label_length = label_length / total
+        results[name] = Result(name, total, accuracy, mean_ned, mean_conf, mean_label_length)
+    num_samples = sum(res.num_samples for res in results.values())
+    return results, 1000 * elapsed / num_samples
+
+
+def results_delta(results: list[Result], reference: dict[str, Result]) -> list[Result]:
+    """Differences against the reference results, per dataset. Can be printed with print_results_table(): the weighted
+    means of the differences are the differences of the weighted means, so the Combined row is correct too."""
+    return [
+        Result(
+            res.dataset,
+            res.num_samples,
+            res.accuracy - reference[res.dataset].accuracy,
+            res.ned - reference[res.dataset].ned,
+            res.confidence - reference[res.dataset].confidence,
+            res.label_length - reference[res.dataset].label_length,
+        )
+        for res in results
+    ]
+
+
+def print_size_latency(model, latency: float, reference, ref_latency: float, batch_size: int, file=None):
+    """Size and latency (see evaluate()) of a quantized model, against the fp32 reference."""
+    size, ref_size = state_dict_size(model), state_dict_size(reference)
+    print(f'Size: {size / 2**20:.1f} MiB (fp32: {ref_size / 2**20:.1f} MiB, {ref_size / size:.2f}x)', file=file)
+    print(
+        f'Latency (CPU, batch size {batch_size}): {latency:.3f} ms/image '
+        f'(fp32: {ref_latency:.3f} ms/image, {ref_latency / latency:.2f}x)',
+        file=file,
+    )
+
+
 @torch.inference_mode()
 def main():
     parser = argparse.ArgumentParser()
@@ -77,8 +147,29 @@ def main():
     parser.add_argument('--punctuation', action='store_true', default=False, help='Check punctuation')
     parser.add_argument('--new', action='store_true', default=False, help='Evaluate on new benchmark datasets')
     parser.add_argument('--rotation', type=int, default=0, help='Angle of rotation (counter clockwise) in degrees.')
+    parser.add_argument(
+        '--reduced_decode', action='store_true', default=False, help='Decode JPEGs at a reduced resolution.'
+    )
+    parser.add_argument(
+        '--fused_transform', action='store_true', default=False, help='Resize with OpenCV directly into the batch.'
+    )
+    parser.add_argument(
+        '--onnx', help='Exported model (see tools/export_onnx.py) to run with ONNX Runtime instead, on the CPU.'
+    )
+    parser.add_argument(
+        '--quantize',
+        choices=['dynamic', 'static'],
+        help='Quantize the model to int8 (on the CPU), and report the size, latency and accuracy deltas against fp32.',
+    )
+    parser.add_argument(
+        '--quantized_weights', help='Weights of the statically quantized model (see tools/quantize_static.py).'
+    )
     parser.add_argument('--device', default='cuda')
     args, unknown = parser.parse_known_args()
+    if args.onnx and args.quantize:
+        parser.error('--onnx and --quantize are mutually exclusive')
+    if args.quantize == 'static' and not args.quantized_weights:
+        parser.error('--quantize static requires --quantized_weights')
     kwargs = parse_model_args(unknown)
 
     charset_test = string.digits + string.ascii_lowercase
@@ -89,7 +180,17 @@ def main():
     kwargs.update({'charset_test': charset_test})
     print(f'Additional keyword arguments: {kwargs}')
 
-    model = load_from_checkpoint(args.checkpoint, **kwargs).eval().to(args.device)
+    device = 'cpu' if args.onnx or args.quantize else args.device
+    model = load_from_checkpoint(args.checkpoint, **kwargs).eval().to(device)
+    reference = None
+    if args.quantize:
+        reference = model
+        model = load_from_checkpoint(
+            args.checkpoint, quantize=args.quantize, quantized_weights=args.quantized_weights, **kwargs
+        )
+    if args.onnx:
+        # The checkpoint is still needed for the tokenizer and the evaluation.
+        model = use_onnx_runtime(model, args.onnx)
     hp = model.hparams
     datamodule = SceneTextDataModule(
         args.data_root,
@@ -102,6 +203,9 @@ def main():
         args.num_workers,
         False,
         rotation=args.rotation,
+        uint8_images=True,
+        reduced_decode=args.reduced_decode,
+        fused_transform=args.fused_transform,
     )
 
     test_set = SceneTextDataModule.TEST_BENCHMARK_SUB + SceneTextDataModule.TEST_BENCHMARK
@@ -109,26 +213,9 @@ def main():
         test_set += SceneTextDataModule.TEST_NEW
     test_set = sorted(set(test_set))
 
-    results = {}
-    max_width = max(map(len, test_set))
-    for name, dataloader in datamodule.test_dataloaders(test_set).items():
-        total = 0
-        correct = 0
-        ned = 0
-        confidence = 0
-        label_length = 0
-        for imgs, labels in tqdm(iter(dataloader), desc=f'{name:>{max_width}}'):
-            res = model.test_step((imgs.to(model.device), labels), -1)['output']
-            total += res.num_samples
-            correct += res.correct
-            ned += res.ned
-            confidence += res.confidence
-            label_length += res.label_length
-        accuracy = 100 * correct / total
-        mean_ned = 100 * (1 - ned / total)
-        mean_conf = 100 * confidence / total
-        mean_label_length = label_length / total
-        results[name] = Result(name, total, accuracy, mean_ned, mean_conf, mean_label_length)
+    results, latency = evaluate(model, datamodule, test_set)
+    if reference is not None:
+        ref_results, ref_latency = evaluate(reference, datamodule, test_set)
 
     result_groups = {
         'Benchmark (Subset)': SceneTextDataModule.TEST_BENCHMARK_SUB,
@@ -142,6 +229,12 @@ def main():
                 print(f'{group} set:', file=out)
                 print_results_table([results[s] for s in subset], out)
                 print('\n', file=out)
+            if reference is not None:
+                for group, subset in result_groups.items():
+                    print(f'{group} set, {args.quantize} int8 - fp32:', file=out)
+                    print_results_table(results_delta([results[s] for s in subset], ref_results), out)
+                    print('\n', file=out)
+                print_size_latency(model, latency, reference, ref_latency, args.batch_size, out)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,63 @@
+"""The exported ONNX graph must match the PyTorch model (with static shapes) for any batch size.
+
+Run with: python -m unittest discover tests
+"""
+import importlib.util
+import tempfile
+import unittest
+from pathlib import Path
+
+import torch
+
+from strhub.models.export import OnnxRuntimeModel, export_onnx
+from strhub.models.utils import create_model
+
+
+@unittest.skipUnless(importlib.util.find_spec('onnxruntime'), 'onnxruntime is not installed')
+class ExportOnnxTest(unittest.TestCase):
+
+    def assert_export_matches(self, model):
+        model.eval()
+        h, w = model.hparams.img_size
+        # The graph is traced with a batch size of 2.
+        images = torch.rand(3, 3, h, w) * 2 - 1
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp, 'model.onnx')
+            export_onnx(model, path)
+            logits = OnnxRuntimeModel(path)(images)
+        model.static_shapes = True
+        with torch.no_grad():
+            expected = model(images)
+        torch.testing.assert_close(logits, expected, rtol=1e-4, atol=1e-4)
+
+    def test_parseq_ar(self):
+        torch.manual_seed(0)
+        self.assert_export_matches(create_model('parseq-tiny', max_label_length=7))
+
+    def test_parseq_nar(self):
+        torch.manual_seed(0)
+        self.assert_export_matches(create_model('parseq-tiny', max_label_length=7, decode_ar=False, refine_iters=1))
+
+    def test_vitstr(self):
+        torch.manual_seed(0)
+        self.assert_export_matches(create_model('vitstr', max_label_length=7))
+
+    def test_crnn(self):
+        torch.manual_seed(0)
+        self.assert_export_matches(create_model('crnn', max_label_length=7))
+
+    def test_trba(self):
+        torch.manual_seed(0)
+        self.assert_export_matches(create_model('trba', max_label_length=7))
+
+    def test_trbc(self):
+        torch.manual_seed(0)
+        self.assert_export_matches(create_model('trbc', max_label_length=7))
+
+    def test_abinet(self):
+        torch.manual_seed(0)
+        self.assert_export_matches(create_model('abinet', max_label_length=7))
+
+
+if __name__ == '__main__':
+    unittest.main()
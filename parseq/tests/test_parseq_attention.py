@@ -0,0 +1,78 @@
+"""The fused (F.scaled_dot_product_attention) path of the PARSeq decoder must match the explicit-weights path.
+
+Run with: python -m unittest discover tests
+"""
+import unittest
+
+import torch
+from torch import nn
+
+from strhub.models.parseq.modules import Attention, Decoder, DecoderLayer
+
+
+class AttentionTest(unittest.TestCase):
+
+    def setUp(self):
+        torch.manual_seed(0)
+        self.attn = Attention(64, 4).eval()
+        self.query = torch.randn(3, 5, 64)
+        self.key_value = torch.randn(3, 7, 64)
+
+    def assert_paths_match(self, **kwargs):
+        with torch.no_grad():
+            fused, no_weights = self.attn(self.query, self.key_value, **kwargs)
+            explicit, weights = self.attn(self.query, self.key_value, need_weights=True, **kwargs)
+        self.assertIsNone(no_weights)
+        torch.testing.assert_close(fused, explicit, rtol=1e-5, atol=1e-5)
+        self.assertEqual(weights.shape, (3, 5, 7))
+        torch.testing.assert_close(weights.sum(-1), torch.ones(3, 5))
+        return weights
+
+    def test_no_mask(self):
+        self.assert_paths_match()
+
+    def test_attn_mask(self):
+        attn_mask = torch.triu(torch.ones(5, 7, dtype=torch.bool), 1)
+        weights = self.assert_paths_match(attn_mask=attn_mask)
+        self.assertTrue((weights[:, attn_mask] == 0).all())
+
+    def test_per_sample_attn_mask(self):
+        attn_mask = torch.rand(3, 1, 5, 7) > 0.7
+        attn_mask[..., 0] = False  # at least one key per query
+        self.assert_paths_match(attn_mask=attn_mask)
+
+    def test_key_padding_mask(self):
+        key_padding_mask = torch.zeros(3, 7, dtype=torch.bool)
+        key_padding_mask[1, 4:] = True
+        weights = self.assert_paths_match(key_padding_mask=key_padding_mask)
+        self.assertTrue((weights[1, :, 4:] == 0).all())
+
+    def test_load_multihead_attention_state_dict(self):
+        mha = nn.MultiheadAttention(64, 4, batch_first=True).eval()
+        self.attn.load_state_dict(mha.state_dict())
+        with torch.no_grad():
+            expected = mha(self.query, self.key_value, self.key_value, need_weights=False)[0]
+            actual = self.attn(self.query, self.key_value)[0]
+        torch.testing.assert_close(actual, expected, rtol=1e-5, atol=1e-5)
+
+
+class DecoderTest(unittest.TestCase):
+
+    def test_need_weights(self):
+        torch.manual_seed(0)
+        layer = DecoderLayer(64, 4, 128, dropout=0.0)
+        decoder = Decoder(layer, num_layers=2, norm=nn.LayerNorm(64)).eval()
+        query = torch.randn(2, 6, 64)
+        content = torch.randn(2, 6, 64)
+        memory = torch.randn(2, 10, 64)
+        mask = torch.triu(torch.ones(6, 6, dtype=torch.bool), 1)
+        with torch.no_grad():
+            out = decoder(query, content, memory, mask, mask)
+            out_w, weights = decoder(query, content, memory, mask, mask, need_weights=True)
+        torch.testing.assert_close(out, out_w, rtol=1e-5, atol=1e-5)
+        self.assertEqual(weights.shape, (2, 2, 6, 10))
+        torch.testing.assert_close(weights.sum(-1), torch.ones(2, 2, 6))
+
+
+if __name__ == '__main__':
+    unittest.main()
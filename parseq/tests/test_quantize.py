@@ -0,0 +1,39 @@
+"""Dynamic int8 quantization (quantize_model()) must reach all the linear layers of the PARSeq decoder.
+
+Run with: python -m unittest discover tests
+"""
+import unittest
+
+import torch
+from torch.ao.nn.quantized import dynamic as nnqd
+
+from strhub.models.utils import create_model, quantize_model
+
+
+class QuantizeModelTest(unittest.TestCase):
+
+    def test_parseq_decoder(self):
+        torch.manual_seed(0)
+        model = create_model('parseq-tiny', max_label_length=7)
+        images = torch.rand(2, 3, *model.hparams.img_size) * 2 - 1
+        model.static_shapes = True
+        with torch.no_grad():
+            expected = model.eval()(images)
+        model = quantize_model(model)
+        for layer in model.model.decoder.layers:
+            for attn in (layer.self_attn, layer.cross_attn):
+                for proj in (attn.q_proj, attn.kv_proj, attn.out_proj):
+                    self.assertIsInstance(proj, nnqd.Linear)
+            self.assertIsInstance(layer.linear1, nnqd.Linear)
+            self.assertIsInstance(layer.linear2, nnqd.Linear)
+        # The classifier is kept in fp32.
+        self.assertIs(type(model.model.head), torch.nn.Linear)
+        with torch.no_grad():
+            logits = model(images)
+        # Random weights: only a rough check of the outputs.
+        self.assertEqual(logits.shape, expected.shape)
+        self.assertGreater(torch.cosine_similarity(logits.flatten(), expected.flatten(), dim=0).item(), 0.9)
+
+
+if __name__ == '__main__':
+    unittest.main()
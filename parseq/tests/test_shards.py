@@ -0,0 +1,86 @@
+"""All the DDP processes must get the same number of (full) batches from a ShardDataset, whatever the shard sizes and
+the number of DataLoader workers. Otherwise, DDP would hang.
+
+Run with: python -m unittest discover tests
+"""
+import io
+import itertools
+import json
+import os
+import tarfile
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from PIL import Image
+
+from torch.utils.data import DataLoader
+from torchvision import transforms as T
+
+from strhub.data.shards import ShardDataset, member_name, shard_name
+
+SHARD_SIZES = (3, 17, 8, 11, 5, 20, 9, 14, 6, 12, 7, 16)
+
+
+def write_shard(path: Path, num_samples: int) -> None:
+    buf = io.BytesIO()
+    Image.new('RGB', (8, 4)).save(buf, format='PNG')
+    imgbuf = buf.getvalue()
+    with tarfile.open(path.with_suffix('.tar'), 'w') as tar:
+        for i in range(num_samples):
+            info = tarfile.TarInfo(member_name(i))
+            info.size = len(imgbuf)
+            tar.addfile(info, io.BytesIO(imgbuf))
+    with open(path.with_suffix('.json'), 'w') as f:
+        json.dump({'num_samples': num_samples, 'labels': ['ab'] * num_samples, 'dims': [[8, 4]] * num_samples}, f)
+
+
+class ShardDatasetTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.TemporaryDirectory()
+        for i, n in enumerate(SHARD_SIZES):
+            write_shard(Path(cls.tmp.name, shard_name(i)), n)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp.cleanup()
+
+    def count_batches(self, rank, world_size, batch_size, num_workers):
+        env = {'RANK': str(rank), 'WORLD_SIZE': str(world_size)}
+        with mock.patch.dict(os.environ, env):
+            dataset = ShardDataset(
+                self.tmp.name,
+                'ab',
+                25,
+                shuffle_buffer=4,
+                transform=T.PILToTensor(),
+                batch_size=batch_size,
+                num_workers=num_workers,
+            )
+            dataloader = DataLoader(dataset, batch_size, num_workers=num_workers, persistent_workers=num_workers > 0)
+            expected = len(dataloader)
+            for _ in range(2):  # epochs
+                sizes = [len(labels) for _, labels in dataloader]
+                self.assertEqual(set(sizes), {batch_size})
+                self.assertEqual(len(sizes), expected)
+        return expected
+
+    def test_same_number_of_batches(self):
+        for world_size, num_workers, batch_size in itertools.product((1, 2, 3), (0, 1, 2), (4, 5)):
+            with self.subTest(world_size=world_size, num_workers=num_workers, batch_size=batch_size):
+                num_batches = [self.count_batches(r, world_size, batch_size, num_workers) for r in range(world_size)]
+                self.assertGreater(num_batches[0], 0)
+                self.assertEqual(len(set(num_batches)), 1)
+
+    def test_too_few_shards(self):
+        with mock.patch.dict(os.environ, {'RANK': '0', 'WORLD_SIZE': '4'}):
+            dataset = ShardDataset(self.tmp.name, 'ab', 25, num_workers=4)
+            with self.assertRaises(ValueError):
+                len(dataset)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+"""Backfill the 'dim-%09d' (image width and height) records of existing LMDB datasets.
+
+Only the image headers are parsed. LmdbDataset uses these records when filtering by min_image_dim.
+"""
+from argparse import ArgumentParser
+
+import lmdb
+
+from strhub.data.dataset import get_image_size
+
+
+def main():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('inputs', nargs='+', help='Path to LMDBs to update in-place')
+    parser.add_argument('--overwrite', action='store_true', default=False, help='Recompute existing records')
+    args = parser.parse_args()
+
+    samples_per_chunk = 10000
+    for lmdb_path in args.inputs:
+        with lmdb.open(lmdb_path, map_size=1099511627776, max_readers=1, readahead=False, meminit=False) as env:
+            with env.begin() as txn:
+                num_samples = int(txn.get('num-samples'.encode()))
+            written = 0
+            for chunk_start in range(1, num_samples + 1, samples_per_chunk):
+                cache = {}
+                with env.begin(buffers=True) as txn:
+                    for index in range(chunk_start, min(chunk_start + samples_per_chunk, num_samples + 1)):
+                        dim_key = f'dim-{index:09d}'.encode()
+                        if not args.overwrite and txn.get(dim_key) is not None:
+                            continue
+                        w, h = get_image_size(txn.get(f'image-{index:09d}'.encode()))
+                        cache[dim_key] = f'{w} {h}'.encode()
+                with env.begin(write=True) as txn:
+                    for k, v in cache.items():
+                        txn.put(k, v)
+                written += len(cache)
+            print(f'{lmdb_path}: written {written} dim records for {num_samples} samples')
+
+
+if __name__ == '__main__':
+    main()
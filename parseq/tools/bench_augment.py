@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""Compare the throughput of the per-sample PIL RandAugment pipeline against the batched tensor one.
+
+The PIL path is what the DataLoader workers run (RandAugment -> Resize -> ToTensor -> Normalize), one image at a time.
+The batched path resizes and collates uint8 images first, then runs BatchRandAugment on `--device`.
+"""
+import argparse
+import time
+
+import numpy as np
+from PIL import Image
+
+import torch
+
+from strhub.data.batch_augment import BatchRandAugment
+from strhub.data.module import SceneTextDataModule
+
+
+def load_images(args) -> list[Image.Image]:
+    if args.lmdb is None:
+        rng = np.random.default_rng(0)
+        sizes = rng.integers((16, 48), (64, 256), size=(args.num_images, 2))
+        return [Image.fromarray(rng.integers(0, 256, (h, w, 3), dtype=np.uint8)) for h, w in sizes]
+    from strhub.data.dataset import LmdbDataset
+
+    dataset = LmdbDataset(args.lmdb, args.charset, args.max_label_length)
+    return [dataset[i][0] for i in range(min(args.num_images, len(dataset)))]
+
+
+def bench_pil(images: list[Image.Image], img_size: tuple[int], batch_size: int) -> float:
+    transform = SceneTextDataModule.get_transform(img_size, augment=True)
+    start = time.perf_counter()
+    for i in range(0, len(images), batch_size):
+        torch.stack([transform(img) for img in images[i : i + batch_size]])
+    return time.perf_counter() - start
+
+
+def bench_batched(images: list[Image.Image], img_size: tuple[int], batch_size: int, device: str) -> float:
+    transform = SceneTextDataModule.get_transform(img_size, normalize=False)
+    augment = BatchRandAugment()
+    # Resize and collation are done by the workers and are not part of the measurement.
+    batches = [
+        torch.stack([transform(img) for img in images[i : i + batch_size]])
+        for i in range(0, len(images), batch_size)
+    ]
+    # Warmup
+    SceneTextDataModule.normalize(augment(batches[0].to(device)))
+    if device.startswith('cuda'):
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    for batch in batches:
+        SceneTextDataModule.normalize(augment(batch.to(device, non_blocking=True)))
+    if device.startswith('cuda'):
+        torch.cuda.synchronize()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--lmdb', help='Source of the images. Random images of varying sizes are used if not set.')
+    parser.add_argument('--charset', default='0123456789abcdefghijklmnopqrstuvwxyz')
+    parser.add_argument('--max_label_length', type=int, default=25)
+    parser.add_argument('--num_images', type=int, default=4096)
+    parser.add_argument('--batch_size', type=int, default=384)
+    parser.add_argument('--img_size', type=int, nargs=2, default=[32, 128])
+    parser.add_argument('--device', default='cuda' if torch.cuda.is_available() else 'cpu')
+    args = parser.parse_args()
+
+    images = load_images(args)
+    n = len(images)
+    print(f'{n} images, batch size {args.batch_size}, image size {args.img_size}')
+    print('| Pipeline              | Device | Time    | Images/s |')
+    print('|:----------------------|:-------|--------:|---------:|')
+    elapsed = bench_pil(images, args.img_size, args.batch_size)
+    print(f'| PIL (1 worker)        | cpu    | {elapsed:>6.2f}s | {n / elapsed:>8.0f} |')
+    elapsed = bench_batched(images, args.img_size, args.batch_size, args.device)
+    print(f'| BatchRandAugment      | {args.device:<6} | {elapsed:>6.2f}s | {n / elapsed:>8.0f} |')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""Eager vs torch.compile'd inference latency (batch size 1) and throughput (larger batch), per model.
+
+Randomly initialized models are used by default. Both the eager and the compiled models use static shapes
+(fixed-length decoding), so that they do the same amount of work. The compiled models are warmed up (i.e. compiled)
+for both batch sizes before timing. The speedup is that of the throughput.
+"""
+import argparse
+
+import torch
+from torch.utils import benchmark
+
+from strhub.models.utils import compile_model, create_model, warmup
+
+
+def measure(model, images: torch.Tensor, min_run_time: float) -> float:
+    timer = benchmark.Timer(stmt='model(images)', globals=dict(model=model, images=images))
+    with torch.inference_mode():
+        return timer.blocked_autorange(min_run_time=min_run_time).median
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--models', nargs='+', default=['parseq-tiny', 'parseq', 'abinet', 'trba', 'vitstr', 'crnn'])
+    parser.add_argument('--pretrained', action='store_true', default=False)
+    parser.add_argument('--batch_size', type=int, default=32, help='Batch size for the throughput measurement')
+    parser.add_argument('--mode', default='default', help='torch.compile mode')
+    parser.add_argument('--min_run_time', type=float, default=2.0)
+    parser.add_argument('--device', default='cpu')
+    args = parser.parse_args()
+
+    results = []
+    for name in args.models:
+        model = create_model(name, args.pretrained).eval().to(args.device)
+        model.static_shapes = True
+        h, w = model.hparams.img_size
+        single = torch.rand(1, 3, h, w, device=args.device)
+        batch = torch.rand(args.batch_size, 3, h, w, device=args.device)
+        eager = [measure(model, x, args.min_run_time) for x in (single, batch)]
+        with torch.inference_mode():
+            ref = model(batch)
+        model = compile_model(model, mode=args.mode, dynamic=False)
+        warmup(model, (1, args.batch_size))
+        compiled = [measure(model, x, args.min_run_time) for x in (single, batch)]
+        with torch.inference_mode():
+            diff = (model(batch) - ref).abs().max().item()
+        results.append((name, eager, compiled, diff))
+
+    print(f'batch size {args.batch_size} (throughput), {args.device}, {torch.get_num_threads()} threads')
+    print('| Model        | Eager (ms) | Compiled (ms) | Eager (img/s) | Compiled (img/s) | Speedup | Max abs diff |')
+    print('|:-------------|-----------:|--------------:|--------------:|-----------------:|--------:|-------------:|')
+    for name, eager, compiled, diff in results:
+        print(
+            f'| {name:<12} | {1000 * eager[0]:>10.2f} | {1000 * compiled[0]:>13.2f} '
+            f'| {args.batch_size / eager[1]:>13.1f} | {args.batch_size / compiled[1]:>16.1f} '
+            f'| {eager[1] / compiled[1]:>6.2f}x | {diff:>12.2e} |'
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""Measure the memory footprint of the DataLoader workers over one epoch of label lookups.
+
+Compares the compact array-backed label index of LmdbDataset against the previous storage (Python lists of str/int).
+Only labels are fetched (no image decoding) so that the measurement isolates the label storage.
+Linux only, since the memory stats are read from /proc/<pid>/smaps_rollup.
+"""
+import argparse
+import os
+import time
+
+from torch.utils.data import DataLoader, Dataset
+
+from strhub.data.dataset import LmdbDataset
+
+
+class LabelsOnly(Dataset):
+
+    def __init__(self, dataset: LmdbDataset, legacy: bool):
+        self.dataset = dataset
+        self.legacy = legacy
+        if legacy:
+            # Previous representation: one Python object per label and per index.
+            self.labels = [dataset.get_label(i) for i in range(len(dataset))]
+            self.filtered_index_list = dataset.filtered_index_list.tolist()
+
+    def __len__(self):
+        return len(self.dataset)
+
+    def __getitem__(self, index):
+        if self.legacy:
+            return self.filtered_index_list[index], self.labels[index]
+        return int(self.dataset.filtered_index_list[index]), self.dataset.get_label(index)
+
+
+def _discard(batch):
+    return len(batch)
+
+
+def memory_stats(pid: int) -> dict[str, int]:
+    """Returns RSS, PSS, and USS (private memory) in MiB."""
+    stats = {}
+    with open(f'/proc/{pid}/smaps_rollup', 'r') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                stats[parts[0].rstrip(':')] = int(parts[1]) // 1024
+    return {
+        'rss': stats['Rss'],
+        'pss': stats['Pss'],
+        'uss': stats['Private_Clean'] + stats['Private_Dirty'],
+    }
+
+
+def run(dataset: LabelsOnly, num_workers: int, batch_size: int):
+    loader = DataLoader(
+        dataset, batch_size=batch_size, shuffle=True, num_workers=num_workers, collate_fn=_discard, prefetch_factor=1
+    )
+    start = time.perf_counter()
+    it = iter(loader)
+    stats_start = [memory_stats(w.pid) for w in it._workers]
+    for _ in it:
+        pass
+    # Workers are still alive until the iterator is garbage collected.
+    stats_end = [memory_stats(w.pid) for w in it._workers]
+    elapsed = time.perf_counter() - start
+    del it
+    return stats_start, stats_end, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('lmdb', help='Path to the LMDB (preferably one with millions of samples)')
+    parser.add_argument('--charset', default='0123456789abcdefghijklmnopqrstuvwxyz')
+    parser.add_argument('--max_label_length', type=int, default=25)
+    parser.add_argument('--num_workers', type=int, default=4)
+    parser.add_argument('--batch_size', type=int, default=384)
+    args = parser.parse_args()
+    if args.num_workers < 1:
+        parser.error('num_workers should be at least 1')
+
+    base = LmdbDataset(args.lmdb, args.charset, args.max_label_length)
+    print(f'{args.lmdb}: {len(base)} samples, {args.num_workers} workers')
+    print('| Storage | Parent RSS | Worker RSS (start -> end) | Worker PSS (end) | Worker USS (end) | Epoch time |')
+    print('|:--------|-----------:|--------------------------:|-----------------:|-----------------:|-----------:|')
+    for name, legacy in [('list', True), ('compact', False)]:
+        dataset = LabelsOnly(base, legacy)
+        parent = memory_stats(os.getpid())
+        start, end, elapsed = run(dataset, args.num_workers, args.batch_size)
+        n = len(end)
+        rss_start = sum(s['rss'] for s in start) / n
+        rss_end = sum(s['rss'] for s in end) / n
+        pss = sum(s['pss'] for s in end) / n
+        uss = sum(s['uss'] for s in end) / n
+        print(
+            f'| {name:<7} | {parent["rss"]:>6} MiB | {rss_start:>8.0f} -> {rss_end:>8.0f} MiB '
+            f'| {pss:>12.0f} MiB | {uss:>12.0f} MiB | {elapsed:>9.2f}s |'
+        )
+        del dataset
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""Compare full vs reduced-resolution (JPEG DCT scaling) decoding of the images of an LMDB.
+
+Reports the decode + resize throughput of both, and how much the final (resized) images differ. For the effect on
+accuracy, compare the output of `./test.py <checkpoint>` against `./test.py <checkpoint> --reduced_decode`.
+"""
+import argparse
+import time
+
+import lmdb
+import numpy as np
+
+from strhub.data.dataset import decode_image
+from strhub.data.module import SceneTextDataModule
+
+
+def load_images(path: str, num_images: int) -> list[bytes]:
+    with lmdb.open(path, readonly=True, max_readers=1, lock=False, readahead=False) as env, env.begin() as txn:
+        num_samples = int(txn.get('num-samples'.encode()))
+        indices = np.random.default_rng(0).permutation(num_samples)[:num_images] + 1  # lmdb starts at 1
+        return [txn.get(f'image-{index:09d}'.encode()) for index in indices.tolist()]
+
+
+def run(images: list[bytes], transform, min_size) -> tuple[float, list[np.ndarray], int]:
+    outputs = []
+    reduced = 0
+    start = time.perf_counter()
+    for buf in images:
+        img = decode_image(buf, min_size)
+        outputs.append(transform(img))
+    elapsed = time.perf_counter() - start
+    if min_size is not None:
+        # Count separately so that it isn't part of the measurement.
+        for buf in images:
+            reduced += decode_image(buf, min_size).size != decode_image(buf).size
+    return elapsed, [o.numpy() for o in outputs], reduced
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('lmdb', help='Path to the LMDB')
+    parser.add_argument('--num_images', type=int, default=10000)
+    parser.add_argument('--img_size', type=int, nargs=2, default=[32, 128], help='Model input size (height, width)')
+    args = parser.parse_args()
+
+    images = load_images(args.lmdb, args.num_images)
+    n = len(images)
+    img_size = tuple(args.img_size)
+    transform = SceneTextDataModule.get_transform(img_size, normalize=False)
+    full_time, full, _ = run(images, transform, None)
+    draft_time, draft, reduced = run(images, transform, img_size)
+    diff = np.stack(full).astype(np.int16) - np.stack(draft).astype(np.int16)
+    print(f'{args.lmdb}: {n} images, {reduced} ({100 * reduced / n:.1f}%) decoded at a reduced resolution')
+    print('| Decoding | Time    | Images/s |')
+    print('|:---------|--------:|---------:|')
+    print(f'| Full     | {full_time:>6.2f}s | {n / full_time:>8.0f} |')
+    print(f'| Reduced  | {draft_time:>6.2f}s | {n / draft_time:>8.0f} |')
+    print(f'Difference of the resized images (uint8): mean abs {np.abs(diff).mean():.3f}, max abs {np.abs(diff).max()}')
+
+
+if __name__ == '__main__':
+    main()
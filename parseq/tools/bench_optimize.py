@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""Numerical parity and speed of strhub.models.optimize_for_inference() on benchmark LMDBs.
+
+The logits of the original and the optimized model are compared with fixed-length decoding (static shapes), so that
+they have the same shape (hence PARSeq cascade/speculative decoding isn't supported). Accuracy and latency are then
+measured with the usual decoding, as in test.py.
+Model runtime parameters can be passed using the format `param:type=value`.
+"""
+import argparse
+import copy
+import string
+import sys
+
+import torch
+
+from strhub.data.module import SceneTextDataModule
+from strhub.models import optimize_for_inference
+from strhub.models.utils import load_from_checkpoint, parse_model_args
+
+sys.path.insert(0, '.')
+from test import evaluate, print_results_table, results_delta
+
+
+@torch.inference_mode()
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('checkpoint', help="Model checkpoint (or 'pretrained=<model_id>')")
+    parser.add_argument('--data_root', default='data')
+    parser.add_argument('--datasets', nargs='+', default=list(SceneTextDataModule.TEST_BENCHMARK))
+    parser.add_argument('--batch_size', type=int, default=64)
+    parser.add_argument('--num_workers', type=int, default=4)
+    parser.add_argument('--no_channels_last', action='store_true', default=False)
+    parser.add_argument('--device', default='cpu')
+    args, unknown = parser.parse_known_args()
+    kwargs = parse_model_args(unknown)
+    kwargs.update({'charset_test': string.digits + string.ascii_lowercase})
+    print(f'Additional keyword arguments: {kwargs}')
+
+    reference = load_from_checkpoint(args.checkpoint, **kwargs).eval().to(args.device)
+    hp = reference.hparams
+    datamodule = SceneTextDataModule(
+        args.data_root,
+        '_unused_',
+        hp.img_size,
+        hp.max_label_length,
+        hp.charset_train,
+        hp.charset_test,
+        args.batch_size,
+        args.num_workers,
+        False,
+        uint8_images=True,
+    )
+    batches = [
+        SceneTextDataModule.normalize(imgs.to(args.device))
+        for dataloader in datamodule.test_dataloaders(args.datasets).values()
+        for imgs, _ in dataloader
+    ]
+    model = optimize_for_inference(copy.deepcopy(reference), not args.no_channels_last, check_images=batches[0])
+
+    max_diff = 0.0
+    mismatches = 0
+    num_samples = 0
+    reference.static_shapes = model.static_shapes = True
+    for images in batches:
+        expected, actual = reference(images), model(images)
+        max_diff = max(max_diff, (actual - expected).abs().max().item())
+        mismatches += (actual.argmax(-1) != expected.argmax(-1)).any(-1).sum().item()
+        num_samples += images.shape[0]
+    reference.static_shapes = model.static_shapes = False
+    print(f'Max abs diff of the logits: {max_diff:.2e}, samples with different predictions: {mismatches}/{num_samples}')
+
+    results, latency = evaluate(model, datamodule, args.datasets)
+    ref_results, ref_latency = evaluate(reference, datamodule, args.datasets)
+    print('Optimized - original:')
+    print_results_table(results_delta([results[s] for s in args.datasets], ref_results))
+    print(
+        f'Latency ({args.device}, batch size {args.batch_size}): {latency:.3f} ms/image '
+        f'(original: {ref_latency:.3f} ms/image, {ref_latency / latency:.2f}x)'
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""Accuracy vs throughput of the PARSeq NAR -> AR decoding cascade, for a range of confidence thresholds.
+
+NAR and AR decoding are the two end points. With the cascade, the whole batch is decoded with NAR first, and only the
+samples with a sequence confidence below the threshold are decoded again with AR. The fraction of re-decoded samples
+is reported for each threshold. All the test batches are loaded on the device beforehand, so data loading isn't
+part of the measurement.
+"""
+import argparse
+import string
+import time
+
+import torch
+
+from strhub.data.module import SceneTextDataModule
+from strhub.models.utils import load_from_checkpoint
+
+
+def sync(device: torch.device):
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+
+
+@torch.inference_mode()
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('checkpoint', help="Model checkpoint (or 'pretrained=<model_id>')")
+    parser.add_argument('--data_root', default='data')
+    parser.add_argument('--batch_size', type=int, default=512)
+    parser.add_argument('--num_workers', type=int, default=4)
+    parser.add_argument('--new', action='store_true', default=False, help='Evaluate on new benchmark datasets')
+    parser.add_argument('--refine_iters', type=int, default=1)
+    parser.add_argument('--thresholds', type=float, nargs='+', default=[0.5, 0.7, 0.8, 0.9, 0.95, 0.99])
+    parser.add_argument('--device', default='cuda')
+    args = parser.parse_args()
+
+    charset_test = string.digits + string.ascii_lowercase
+    system = load_from_checkpoint(args.checkpoint, charset_test=charset_test, refine_iters=args.refine_iters)
+    system = system.eval().to(args.device)
+    model = system.model
+    hp = system.hparams
+    datamodule = SceneTextDataModule(
+        args.data_root,
+        '_unused_',
+        hp.img_size,
+        hp.max_label_length,
+        hp.charset_train,
+        hp.charset_test,
+        args.batch_size,
+        args.num_workers,
+        False,
+        uint8_images=True,
+    )
+    test_set = SceneTextDataModule.TEST_BENCHMARK_SUB + SceneTextDataModule.TEST_BENCHMARK
+    if args.new:
+        test_set += SceneTextDataModule.TEST_NEW
+    batches = [
+        (SceneTextDataModule.normalize(imgs.to(system.device)), labels)
+        for dataloader in datamodule.test_dataloaders(sorted(set(test_set))).values()
+        for imgs, labels in dataloader
+    ]
+    num_samples = sum(len(labels) for _, labels in batches)
+
+    # Sequence confidence of the NAR (+ refinement) output, which is what the cascade thresholds.
+    model.decode_ar = False
+    model.cascade_threshold = None
+    confidence = torch.cat([model.sequence_confidence(system.tokenizer, system(imgs)) for imgs, _ in batches])
+
+    def evaluate() -> tuple[float, float]:
+        system(batches[0][0])  # warmup
+        sync(system.device)
+        start = time.perf_counter()
+        correct = int(sum(system.test_step(batch, -1)['output'].correct for batch in batches))
+        sync(system.device)
+        return 100 * correct / num_samples, num_samples / (time.perf_counter() - start)
+
+    configs = [('NAR', False, None)]
+    configs += [(f'Cascade @ {t:g}', False, t) for t in sorted(args.thresholds)]
+    configs.append(('AR', True, None))
+    print(f'{args.checkpoint}: {num_samples} samples, batch size {args.batch_size}, refine_iters {args.refine_iters}')
+    print('| Decoding         | Re-decoded (%) | Accuracy | Images/s |')
+    print('|:-----------------|---------------:|---------:|---------:|')
+    for name, decode_ar, threshold in configs:
+        model.decode_ar = decode_ar
+        model.cascade_threshold = threshold
+        accuracy, throughput = evaluate()
+        if threshold is not None:
+            redecoded = 100 * (confidence < threshold).float().mean().item()
+        else:
+            redecoded = 100.0 if decode_ar else 0.0
+        print(f'| {name:<16} | {redecoded:>14.1f} | {accuracy:>8.2f} | {throughput:>8.0f} |')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""Latency of PARSeq AR decoding, with and without the key/value caches, across label lengths.
+
+kv_cache enables both the cache of the self-attention keys/values of past tokens and the precomputed cross-attention
+keys/values of the encoder output (also used by the refinement iterations, see --refine_iters).
+
+The number of decoding steps is fixed by `max_length` (early exit is disabled), so random images can be used.
+Parity of the cached decoding with the reference one is checked on the logits and on the predicted tokens.
+"""
+import argparse
+
+import torch
+from torch.utils import benchmark
+
+from strhub.models.utils import create_model
+
+
+@torch.inference_mode()
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--model', default='parseq', help='PARSeq experiment, e.g. parseq or parseq-tiny')
+    parser.add_argument('--pretrained', action='store_true', default=False)
+    parser.add_argument('--batch_size', type=int, default=1)
+    parser.add_argument('--lengths', type=int, nargs='+', default=[1, 5, 9, 13, 17, 21, 25])
+    parser.add_argument('--refine_iters', type=int, default=0)
+    parser.add_argument('--min_run_time', type=float, default=1.0)
+    parser.add_argument('--device', default='cuda' if torch.cuda.is_available() else 'cpu')
+    args = parser.parse_args()
+
+    system = create_model(args.model, args.pretrained, decode_ar=True, refine_iters=args.refine_iters)
+    system = system.eval().to(args.device)
+    model = system.model
+    h, w = system.hparams.img_size
+    images = torch.rand(args.batch_size, 3, h, w, device=args.device)
+
+    def run(length, kv_cache):
+        model.kv_cache = kv_cache
+        return system(images, length)
+
+    print(f'{args.model}, batch size {args.batch_size}, {args.device}')
+    print('| Length | No cache (ms) | KV cache (ms) | Speedup | Max abs diff | Same preds |')
+    print('|-------:|--------------:|--------------:|--------:|-------------:|:----------:|')
+    for length in args.lengths:
+        times = []
+        for kv_cache in (False, True):
+            timer = benchmark.Timer(
+                stmt='run(length, kv_cache)', globals=dict(run=run, length=length, kv_cache=kv_cache)
+            )
+            times.append(timer.blocked_autorange(min_run_time=args.min_run_time).median * 1000)
+        ref = run(length, False)
+        out = run(length, True)
+        diff = (out - ref).abs().max().item()
+        same = torch.equal(out.argmax(-1), ref.argmax(-1))
+        print(
+            f'| {length:>6} | {times[0]:>13.2f} | {times[1]:>13.2f} | {times[0] / times[1]:>6.2f}x '
+            f'| {diff:>12.2e} | {"yes" if same else "no":^10} |'
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""CPU (by default) benchmark of the PARSeq decoder attention: fused F.scaled_dot_product_attention vs explicit.
+
+The explicit path (softmax(QK^T)V with materialized attention weights, as computed by nn.MultiheadAttention) is the
+one taken when the attention weights are requested. Both are timed for a training step (forward + backward over all
+the permutations) and for AR inference, on random images and labels, using a randomly initialized model.
+Parity of the two is checked on the logits.
+"""
+import argparse
+
+import torch
+from torch.utils import benchmark
+
+from strhub.models.parseq.modules import Attention
+from strhub.models.utils import create_model
+
+_forward = Attention.forward
+
+
+def _explicit_forward(self, *args, **kwargs):
+    kwargs['need_weights'] = True
+    return _forward(self, *args, **kwargs)
+
+
+def use_sdpa(enabled: bool):
+    Attention.forward = _forward if enabled else _explicit_forward
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--model', default='parseq', help='PARSeq experiment, e.g. parseq or parseq-tiny')
+    parser.add_argument('--batch_size', type=int, default=32)
+    parser.add_argument('--min_run_time', type=float, default=2.0)
+    parser.add_argument('--threads', type=int, default=torch.get_num_threads())
+    parser.add_argument('--device', default='cpu')
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    torch.set_num_threads(args.threads)
+    system = create_model(args.model).to(args.device)
+    charset = system.hparams.charset_train
+    h, w = system.hparams.img_size
+    images = torch.rand(args.batch_size, 3, h, w, device=args.device)
+    lengths = torch.randint(1, system.hparams.max_label_length + 1, (args.batch_size,)).tolist()
+    labels = [''.join(charset[i] for i in torch.randint(len(charset), (n,)).tolist()) for n in lengths]
+
+    def train_step():
+        system.train()
+        loss = system.training_step((images, labels), 0)
+        loss.backward()
+        system.zero_grad(set_to_none=True)
+
+    @torch.inference_mode()
+    def inference():
+        system.eval()
+        # Fixed number of decoding steps (no early exit), so that the outputs of both paths can be compared.
+        return system(images, system.hparams.max_label_length)
+
+    rows = []
+    for name, fn in (('Training step', train_step), ('AR inference', inference)):
+        times = []
+        for enabled in (False, True):
+            use_sdpa(enabled)
+            timer = benchmark.Timer(stmt='fn()', globals=dict(fn=fn), num_threads=args.threads)
+            times.append(timer.blocked_autorange(min_run_time=args.min_run_time).median * 1000)
+        rows.append((name, *times))
+    use_sdpa(False)
+    ref = inference()
+    use_sdpa(True)
+    out = inference()
+
+    print(f'{args.model}, batch size {args.batch_size}, {args.device}, {args.threads} threads')
+    print('| Benchmark     | Explicit (ms) | SDPA (ms) | Speedup |')
+    print('|:--------------|--------------:|----------:|--------:|')
+    for name, explicit, sdpa in rows:
+        print(f'| {name:<13} | {explicit:>13.2f} | {sdpa:>9.2f} | {explicit / sdpa:>6.2f}x |')
+    print(f'Max abs diff of the logits: {(out - ref).abs().max().item():.2e}')
+
+
+if __name__ == '__main__':
+    main()
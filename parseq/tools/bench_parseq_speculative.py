@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""Compare greedy AR decoding of PARSeq against speculative decoding (parallel verification of the NAR prediction).
+
+Both should produce the same predictions. Reported per batch are the number of sequential decoder passes (calls to the
+output head, including the NAR draft and the refinement iterations), and the latency. All the test batches are loaded
+on the device beforehand, so data loading isn't part of the measurement.
+"""
+import argparse
+import string
+import sys
+import time
+
+import torch
+
+from strhub.data.module import SceneTextDataModule
+from strhub.models.utils import load_from_checkpoint
+
+
+def sync(device: torch.device):
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+
+
+@torch.inference_mode()
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('checkpoint', help="Model checkpoint (or 'pretrained=<model_id>')")
+    parser.add_argument('--data_root', default='data')
+    parser.add_argument('--batch_size', type=int, default=512)
+    parser.add_argument('--num_workers', type=int, default=4)
+    parser.add_argument('--new', action='store_true', default=False, help='Evaluate on new benchmark datasets')
+    parser.add_argument('--refine_iters', type=int, default=0)
+    parser.add_argument('--device', default='cuda')
+    args = parser.parse_args()
+
+    charset_test = string.digits + string.ascii_lowercase
+    system = load_from_checkpoint(
+        args.checkpoint, charset_test=charset_test, decode_ar=True, refine_iters=args.refine_iters
+    )
+    system = system.eval().to(args.device)
+    model = system.model
+    hp = system.hparams
+    datamodule = SceneTextDataModule(
+        args.data_root,
+        '_unused_',
+        hp.img_size,
+        hp.max_label_length,
+        hp.charset_train,
+        hp.charset_test,
+        args.batch_size,
+        args.num_workers,
+        False,
+        uint8_images=True,
+    )
+    test_set = SceneTextDataModule.TEST_BENCHMARK_SUB + SceneTextDataModule.TEST_BENCHMARK
+    if args.new:
+        test_set += SceneTextDataModule.TEST_NEW
+    batches = [
+        SceneTextDataModule.normalize(imgs.to(system.device))
+        for dataloader in datamodule.test_dataloaders(sorted(set(test_set))).values()
+        for imgs, _ in dataloader
+    ]
+    num_samples = sum(len(imgs) for imgs in batches)
+
+    passes = 0
+
+    def count_pass(*_):
+        nonlocal passes
+        passes += 1
+
+    model.head.register_forward_hook(count_pass)
+
+    def run(speculative: bool) -> tuple[list[str], float, float]:
+        nonlocal passes
+        model.speculative = speculative
+        system(batches[0])  # warmup
+        preds = []
+        passes = 0
+        sync(system.device)
+        start = time.perf_counter()
+        for imgs in batches:
+            preds.extend(system.tokenizer.decode(system(imgs).softmax(-1))[0])
+        sync(system.device)
+        elapsed = time.perf_counter() - start
+        return preds, passes / len(batches), 1000 * elapsed / len(batches)
+
+    ar_preds, ar_passes, ar_time = run(False)
+    spec_preds, spec_passes, spec_time = run(True)
+    mismatches = sum(a != b for a, b in zip(ar_preds, spec_preds))
+    print(f'{args.checkpoint}: {num_samples} samples, batch size {args.batch_size}, refine_iters {args.refine_iters}')
+    print('| Decoding    | Passes/batch | Latency/batch (ms) |')
+    print('|:------------|-------------:|-------------------:|')
+    print(f'| AR          | {ar_passes:>12.1f} | {ar_time:>18.2f} |')
+    print(f'| Speculative | {spec_passes:>12.1f} | {spec_time:>18.2f} |')
+    print(f'Predictions which differ from AR: {mismatches}')
+    if mismatches:
+        sys.exit('Parity check failed')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""Compare the batched Tokenizer/CTCTokenizer decode against the reference per-sample implementation.
+
+Random token distributions are used. For the Tokenizer, a random EOS position is forced into most sequences, and
+for the CTCTokenizer, blanks and repeated tokens are made frequent, so that the filtering has something to do.
+"""
+import argparse
+import sys
+import time
+from itertools import groupby
+
+import torch
+
+from strhub.data.utils import CTCTokenizer, Tokenizer
+
+
+def reference_decode(tokenizer, token_dists):
+    """Per-sample decode as it was before batching."""
+    batch_tokens = []
+    batch_probs = []
+    for dist in token_dists:
+        probs, ids = dist.max(-1)
+        ids = ids.tolist()
+        if isinstance(tokenizer, CTCTokenizer):
+            ids = [x for x, _ in groupby(ids) if x != tokenizer.blank_id]
+        else:
+            eos_idx = ids.index(tokenizer.eos_id) if tokenizer.eos_id in ids else len(ids)
+            ids = ids[:eos_idx]
+            probs = probs[: eos_idx + 1]
+        batch_tokens.append(''.join(tokenizer._itos[i] for i in ids))
+        batch_probs.append(probs)
+    return batch_tokens, batch_probs
+
+
+def random_dists(tokenizer, batch_size: int, length: int, device: str) -> torch.Tensor:
+    logits = torch.randn(batch_size, length, len(tokenizer), device=device)
+    if isinstance(tokenizer, CTCTokenizer):
+        logits[..., tokenizer.blank_id] += 1.5
+        # Repeat the previous position
+        repeat = torch.rand(batch_size, length, device=device) < 0.3
+        logits[:, 1:][repeat[:, 1:]] = logits[:, :-1][repeat[:, 1:]]
+    else:
+        eos = torch.randint(length + length // 4, (batch_size,), device=device)
+        rows = (eos < length).nonzero().squeeze(1)
+        logits[rows, eos[rows], tokenizer.eos_id] += 10
+    return logits.softmax(-1)
+
+
+def timeit(fn, *args, device: str, repeat: int = 10) -> float:
+    fn(*args)
+    if device.startswith('cuda'):
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn(*args)
+    if device.startswith('cuda'):
+        torch.cuda.synchronize()
+    return 1000 * (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--charset', default='0123456789abcdefghijklmnopqrstuvwxyz')
+    parser.add_argument('--batch_size', type=int, default=512)
+    parser.add_argument('--length', type=int, default=26)
+    parser.add_argument('--device', default='cuda' if torch.cuda.is_available() else 'cpu')
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    failed = False
+    print(f'batch size {args.batch_size}, length {args.length}, {args.device}')
+    print('| Tokenizer    | Reference (ms) | Batched (ms) | Speedup | Same output |')
+    print('|:-------------|---------------:|-------------:|--------:|:-----------:|')
+    for tokenizer in (Tokenizer(args.charset), CTCTokenizer(args.charset)):
+        dists = random_dists(tokenizer, args.batch_size, args.length, args.device)
+        ref_tokens, ref_probs = reference_decode(tokenizer, dists)
+        tokens, probs, confidence = tokenizer.decode(dists, return_confidence=True)
+        same = tokens == ref_tokens and all(torch.equal(p, q) for p, q in zip(probs, ref_probs))
+        same &= torch.allclose(confidence, torch.stack([p.prod() for p in ref_probs]))
+        failed |= not same
+        ref_time = timeit(reference_decode, tokenizer, dists, device=args.device)
+        batched_time = timeit(tokenizer.decode, dists, device=args.device)
+        print(
+            f'| {type(tokenizer).__name__:<12} | {ref_time:>14.2f} | {batched_time:>12.2f} '
+            f'| {ref_time / batched_time:>6.2f}x | {"yes" if same else "no":^11} |'
+        )
+    if failed:
+        sys.exit('Parity check failed')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""Compare the default per-sample transform + collation against FusedResizeCollate.
+
+Both pipelines start from decoded PIL images and output a batch of resized images. The default one is
+Resize (bicubic) -> ToTensor -> Normalize -> default_collate, the fused one resizes with OpenCV straight into the batch.
+The parity check compares the resized uint8 images of both and fails if the mean absolute difference exceeds
+`--tolerance`.
+"""
+import argparse
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+
+import torch
+from torch.utils.data import default_collate
+
+from strhub.data.fused import FusedResizeCollate
+from strhub.data.module import SceneTextDataModule
+
+
+def load_images(args) -> list[Image.Image]:
+    if args.lmdb is None:
+        # Smooth random images, so that the parity check isn't dominated by aliasing of pure noise.
+        rng = np.random.default_rng(0)
+        sizes = rng.integers((16, 48), (128, 512), size=(args.num_images, 2))
+        return [
+            Image.fromarray(rng.integers(0, 256, (8, 32, 3), dtype=np.uint8)).resize((w, h), Image.BILINEAR)
+            for h, w in sizes
+        ]
+    from strhub.data.dataset import LmdbDataset
+
+    dataset = LmdbDataset(args.lmdb, args.charset, args.max_label_length)
+    return [dataset[i][0] for i in range(min(args.num_images, len(dataset)))]
+
+
+def bench(collate, samples: list, batch_size: int) -> tuple[float, list[torch.Tensor]]:
+    outputs = []
+    start = time.perf_counter()
+    for i in range(0, len(samples), batch_size):
+        outputs.append(collate(samples[i : i + batch_size])[0])
+    return time.perf_counter() - start, outputs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--lmdb', help='Source of the images. Random images of varying sizes are used if not set.')
+    parser.add_argument('--charset', default='0123456789abcdefghijklmnopqrstuvwxyz')
+    parser.add_argument('--max_label_length', type=int, default=25)
+    parser.add_argument('--num_images', type=int, default=4096)
+    parser.add_argument('--batch_size', type=int, default=384)
+    parser.add_argument('--img_size', type=int, nargs=2, default=[32, 128])
+    parser.add_argument('--tolerance', type=float, default=2.0, help='Max mean absolute difference (uint8 scale)')
+    args = parser.parse_args()
+
+    images = load_images(args)
+    n = len(images)
+    img_size = tuple(args.img_size)
+    transform = SceneTextDataModule.get_transform(img_size)
+
+    def default(batch):
+        return default_collate([(transform(img), label) for img, label in batch])
+
+    samples = [(img, '') for img in images]
+    default_time, default_out = bench(default, samples, args.batch_size)
+    fused_time, fused_out = bench(FusedResizeCollate(img_size, pin_memory=False), samples, args.batch_size)
+
+    print(f'{n} images, batch size {args.batch_size}, image size {img_size}')
+    print('| Pipeline            | Time    | Images/s |')
+    print('|:--------------------|--------:|---------:|')
+    print(f'| PIL + default       | {default_time:>6.2f}s | {n / default_time:>8.0f} |')
+    print(f'| FusedResizeCollate  | {fused_time:>6.2f}s | {n / fused_time:>8.0f} |')
+
+    # Back to the uint8 scale for comparison.
+    expected = torch.cat(default_out).add(1).mul(127.5).round()
+    diff = (torch.cat(fused_out).float() - expected).abs()
+    mean_diff = diff.mean().item()
+    print(f'Difference (uint8): mean abs {mean_diff:.3f}, max abs {diff.max().item():.0f}, tolerance {args.tolerance}')
+    if mean_diff > args.tolerance:
+        sys.exit('Parity check failed')
+
+
+if __name__ == '__main__':
+    main()
@@ -30,6 +30,9 @@ def createDataset(inputPath, gtFile, outputPath, checkValid=True):
         outputPath : LMDB output path
         gtFile     : list of image path and label
         checkValid : if true, check the validity of every image
+
+    The image dimensions are stored as 'dim-%09d' records ("<width> <height>") so that datasets can be filtered
+    by image size without reading the images.
     """
     os.makedirs(outputPath, exist_ok=True)
     env = lmdb.open(outputPath, map_size=1099511627776)
@@ -56,11 +59,16 @@ def createDataset(inputPath, gtFile, outputPath, checkValid=True):
             if np.prod(img.size) == 0:
                 print('%s is not a valid image' % imagePath)
                 continue
+        else:
+            # Only parses the header
+            img = Image.open(io.BytesIO(imageBin))
 
         imageKey = 'image-%09d'.encode() % cnt
         labelKey = 'label-%09d'.encode() % cnt
+        dimKey = 'dim-%09d'.encode() % cnt
         cache[imageKey] = imageBin
         cache[labelKey] = label.encode()
+        cache[dimKey] = '{} {}'.format(*img.size).encode()
 
         if cnt % 1000 == 0:
             writeCache(env, cache)
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""Export a model to ONNX (images -> logits, dynamic batch size), then check it against PyTorch with ONNX Runtime.
+
+Model runtime parameters can be passed using the format `param:type=value`, e.g. for the PARSeq NAR variant:
+    ./tools/export_onnx.py pretrained=parseq parseq-nar.onnx decode_ar:bool=false refine_iters:int=2
+The exported model can then be used with `./test.py pretrained=parseq --onnx parseq-nar.onnx` (the checkpoint is
+still needed for the tokenizer and the evaluation) or with read.py.
+"""
+import argparse
+import time
+
+import torch
+
+from strhub.models.export import export_onnx, use_onnx_runtime
+from strhub.models.utils import load_from_checkpoint, parse_model_args
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('checkpoint', help="Model checkpoint (or 'pretrained=<model_id>')")
+    parser.add_argument('output', help='Path of the ONNX model')
+    parser.add_argument('--opset', type=int, default=17)
+    parser.add_argument('--batch_size', type=int, default=8, help='Batch size for the check')
+    parser.add_argument('--repeat', type=int, default=10, help='Number of runs to time for the check')
+    args, unknown = parser.parse_known_args()
+    kwargs = parse_model_args(unknown)
+    print(f'Additional keyword arguments: {kwargs}')
+
+    model = load_from_checkpoint(args.checkpoint, **kwargs).eval().cpu()
+    export_onnx(model, args.output, args.opset)
+    print(f'Exported to {args.output}')
+
+    # Compare against eager PyTorch, with the same (static) shapes.
+    h, w = model.hparams.img_size
+    images = torch.rand(args.batch_size, 3, h, w) * 2 - 1
+    model.static_shapes = True
+    times = {}
+    outputs = {}
+    with torch.inference_mode():
+        for name in ('PyTorch', 'ONNX Runtime'):
+            if name == 'ONNX Runtime':
+                model = use_onnx_runtime(model, args.output)
+            outputs[name] = model(images)
+            start = time.perf_counter()
+            for _ in range(args.repeat):
+                model(images)
+            times[name] = 1000 * (time.perf_counter() - start) / args.repeat
+    ref, out = outputs.values()
+    same = torch.equal(ref.argmax(-1), out.argmax(-1))
+    print(f'Max abs diff of the logits: {(out - ref).abs().max().item():.2e}, same predictions: {same}')
+    print(f'Latency (batch size {args.batch_size}): ' + ', '.join(f'{k} {v:.2f} ms' for k, v in times.items()))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,11 @@
 #!/usr/bin/env python3
-import io
 import os
 from argparse import ArgumentParser
 
 import lmdb
 import numpy as np
-from PIL import Image
+
+from strhub.data.dataset import read_image_dims
 
 
 def main():
@@ -31,19 +31,19 @@ def main():
                     with env_in.begin() as txn:
                         for index in chunk:
                             index += 1  # lmdb starts at 1
-                            image_key = f'image-{index:09d}'.encode()
-                            image_bin = txn.get(image_key)
-                            img = Image.open(io.BytesIO(image_bin))
-                            w, h = img.size
+                            w, h = read_image_dims(txn, index)
                             if w < args.min_image_dim or h < args.min_image_dim:
                                 print(f'Skipping: {index}, w = {w}, h = {h}')
                                 continue
                             out_samples += 1  # increment. start at 1
                             label_key = f'label-{index:09d}'.encode()
+                            image_key = f'image-{index:09d}'.encode()
                             out_label_key = f'label-{out_samples:09d}'.encode()
                             out_image_key = f'image-{out_samples:09d}'.encode()
+                            out_dim_key = f'dim-{out_samples:09d}'.encode()
                             cache[out_label_key] = txn.get(label_key)
-                            cache[out_image_key] = image_bin
+                            cache[out_image_key] = txn.get(image_key)
+                            cache[out_dim_key] = f'{w} {h}'.encode()
                     with env_out.begin(write=True) as txn:
                         for k, v in cache.items():
                             txn.put(k, v)
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""Convert a tree of LMDBs into shards (see strhub.data.shards) for sequential reading.
+
+The directory structure is preserved: <root>/<path>/data.mdb becomes <output>/<path>/shard-NNNNN.{tar,json}.
+Raw labels are kept so that label preprocessing (charset, max_label_length, etc.) still happens at load time.
+"""
+import argparse
+import glob
+import io
+import json
+import os
+import tarfile
+from pathlib import Path
+
+import lmdb
+import numpy as np
+
+from strhub.data.dataset import read_image_dims
+from strhub.data.shards import member_name, shard_name
+
+
+def write_shard(path: Path, images: list[bytes], labels: list[str], dims: list[tuple[int, int]]) -> None:
+    with tarfile.open(path.with_suffix('.tar'), 'w', format=tarfile.PAX_FORMAT) as tar:
+        for i, imgbuf in enumerate(images):
+            info = tarfile.TarInfo(member_name(i))
+            info.size = len(imgbuf)
+            tar.addfile(info, io.BytesIO(imgbuf))
+    # The index is written last. A shard without one is incomplete.
+    with open(path.with_suffix('.json'), 'w') as f:
+        json.dump({'num_samples': len(labels), 'labels': labels, 'dims': dims}, f, ensure_ascii=False)
+
+
+def convert(lmdb_path: str, output: Path, samples_per_shard: int, shuffle: bool, seed: int) -> tuple[int, int]:
+    output.mkdir(parents=True, exist_ok=True)
+    with lmdb.open(lmdb_path, readonly=True, max_readers=1, lock=False, readahead=False) as env, env.begin() as txn:
+        num_samples = int(txn.get('num-samples'.encode()))
+        indices = np.arange(1, num_samples + 1)  # lmdb starts at 1
+        if shuffle:
+            np.random.default_rng(seed).shuffle(indices)
+        num_shards = 0
+        for start in range(0, num_samples, samples_per_shard):
+            images, labels, dims = [], [], []
+            for index in indices[start : start + samples_per_shard].tolist():
+                images.append(txn.get(f'image-{index:09d}'.encode()))
+                labels.append(txn.get(f'label-{index:09d}'.encode()).decode())
+                dims.append(read_image_dims(txn, index))
+            write_shard(output / shard_name(num_shards), images, labels, dims)
+            num_shards += 1
+    return num_samples, num_shards
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('root', help='Root directory of the LMDBs')
+    parser.add_argument('output', help='Output directory')
+    parser.add_argument('--samples_per_shard', type=int, default=10000)
+    parser.add_argument(
+        '--shuffle', action='store_true', default=False, help='Shuffle the samples of each LMDB before sharding'
+    )
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    root = Path(args.root).absolute()
+    mdbs = sorted(Path(mdb).parent for mdb in glob.glob(str(root / '**/data.mdb'), recursive=True))
+    for mdb in mdbs:
+        rel = mdb.relative_to(root)
+        num_samples, num_shards = convert(
+            os.fspath(mdb), Path(args.output, rel), args.samples_per_shard, args.shuffle, args.seed
+        )
+        print(f'{rel}: {num_samples} samples written to {num_shards} shards')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""Static post-training int8 quantization (FX graph mode) of the convolutional feature extractors, for the CPU.
+
+Supported models are those with BaseSystem.quantizable_modules, i.e. CRNN, TRBA/TRBC and ABINet. The activation ranges
+are calibrated on a random sample of an LMDB dataset (by default, the validation set). The state_dict of the quantized
+model is saved to `output`, then the quantized model is evaluated against fp32 on the benchmark sets.
+
+Model runtime parameters can be passed using the format `param:type=value`. The quantized model can then be used with:
+    ./test.py crnn.ckpt --quantize static --quantized_weights crnn-int8.pt
+(or read.py with the same arguments).
+"""
+import argparse
+import copy
+import string
+import sys
+
+import torch
+from torch.utils.data import DataLoader, Subset
+
+from strhub.data.dataset import build_tree_dataset
+from strhub.data.module import SceneTextDataModule
+from strhub.models.utils import load_from_checkpoint, parse_model_args, quantize_static
+
+sys.path.insert(0, '.')
+from test import evaluate, print_results_table, print_size_latency, results_delta
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('checkpoint', help="Model checkpoint (or 'pretrained=<model_id>')")
+    parser.add_argument('output', help='Path of the quantized weights')
+    parser.add_argument('--data_root', default='data')
+    parser.add_argument('--calibration_data', help='Root of the calibration LMDBs (default: <data_root>/val)')
+    parser.add_argument('--num_calibration', type=int, default=1024, help='Number of calibration samples')
+    parser.add_argument('--batch_size', type=int, default=64)
+    parser.add_argument('--num_workers', type=int, default=4)
+    parser.add_argument('--backend', default='x86', help='Quantized engine: x86, fbgemm or qnnpack')
+    parser.add_argument('--seed', type=int, default=0)
+    args, unknown = parser.parse_known_args()
+    kwargs = parse_model_args(unknown)
+    kwargs.update({'charset_test': string.digits + string.ascii_lowercase})
+    print(f'Additional keyword arguments: {kwargs}')
+
+    reference = load_from_checkpoint(args.checkpoint, **kwargs).eval().cpu()
+    hp = reference.hparams
+
+    root = args.calibration_data or f'{args.data_root}/val'
+    transform = SceneTextDataModule.get_transform(hp.img_size)
+    dataset = build_tree_dataset(root, hp.charset_test, hp.max_label_length, transform=transform)
+    generator = torch.Generator().manual_seed(args.seed)
+    indices = torch.randperm(len(dataset), generator=generator)[: args.num_calibration].tolist()
+    dataloader = DataLoader(Subset(dataset, indices), args.batch_size, num_workers=args.num_workers)
+    print(f'Calibrating on {len(indices)} samples from {root}')
+    model = quantize_static(copy.deepcopy(reference), (images for images, _ in dataloader), args.backend)
+    torch.save(model.state_dict(), args.output)
+    print(f'Saved the quantized weights to {args.output}')
+
+    datamodule = SceneTextDataModule(
+        args.data_root,
+        '_unused_',
+        hp.img_size,
+        hp.max_label_length,
+        hp.charset_train,
+        hp.charset_test,
+        args.batch_size,
+        args.num_workers,
+        False,
+        uint8_images=True,
+    )
+    test_set = list(SceneTextDataModule.TEST_BENCHMARK)
+    with torch.inference_mode():
+        results, latency = evaluate(model, datamodule, test_set)
+        ref_results, ref_latency = evaluate(reference, datamodule, test_set)
+    for name, res in (('fp32', ref_results), ('Static int8', results)):
+        print(f'{name}:')
+        print_results_table([res[s] for s in test_set])
+        print()
+    print('Static int8 - fp32:')
+    print_results_table(results_delta([results[s] for s in test_set], ref_results))
+    print()
+    print_size_latency(model, latency, reference, ref_latency, args.batch_size)
+
+
+if __name__ == '__main__':
+    main()
@@ -94,6 +94,7 @@ def main():
             ned += res.ned
             confidence += res.confidence
             label_length += res.label_length
+        correct, ned, confidence, label_length = map(float, (correct, ned, confidence, label_length))
         accuracy = 100 * correct / total
         mean_ned = 100 * (1 - ned / total)
         mean_conf = 100 * confidence / total